@@ -1,27 +1,68 @@
 #!/usr/bin/python3
 
-import subprocess
 import logging
 import datetime
 import asyncio
 import argparse
-import json
+import configparser
+import itertools
+import threading
+import urllib.parse
+import time
 import sys
+import os
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "common"), "/usr/local/lib/incus-tools"]
+from incus_client import IncusError, get_client
+from incus_catalog import VolumeCatalog
+from incus_retention import RetentionPolicy, plan_deletions, delete_snapshots
+from incus_metrics import MetricsRecorder, InstrumentedClient
+from incus_journal import RunJournal, is_transient, backoff_delay, MAX_RESUMES
+from incus_output import print_table
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(levelname)s] %(asctime)s - %(message)s',
+    datefmt='%d-%m-%Y %H:%M:%S'
+)
 
 class IncusSnapper():
     def __init__(self,**kwargs):
+        self.metrics        = MetricsRecorder("snapshot")
+        self.client         = InstrumentedClient(get_client(kwargs['client']), self.metrics)
         # Instances
-        self.filter         = "user.auto-snapshot=true"
+        self.filter         = {"user.auto-snapshot": "true"}
+        self.project        = kwargs['project']
         self.instances      = self.get_local_instances()
         # Storage
-        self.pools          = self.get_local_pools()
+        self.catalog        = VolumeCatalog(self.client, project=self.project)
         self.snap_volumes        = True if kwargs['include_volumes'] == True else False
         # Snapshot
         self.expiry         = kwargs['expiry']
-        self.snapshot_name  = self.create_snapshot_name(kwargs['prefix'])
+        self.prefix         = kwargs['prefix']
+        self.snapshot_name  = self.create_snapshot_name(self.prefix)
+        self.retention      = kwargs['retention']
+        # Workers
+        self.jobs           = kwargs['jobs']
+        self.pool_jobs      = kwargs['pool_jobs']
+        self.results        = []
+        # Journal, one per prefix so hourly and daily runs do not replace each other's,
+        # the daemon opens the one of each schedule when it fires
+        self.journal_file   = kwargs['journal_file']
+        self.journal        = None if kwargs['daemon'] else RunJournal(self.journal_path(self.prefix))
+        self.resume         = kwargs['resume']
+        self.retries        = kwargs['retries']
+        self.retry_backoff  = kwargs['retry_backoff']
         # Args
         self.list_only      = kwargs['list_enabled']
         self.verbose        = kwargs['verbose']
+        # Metrics
+        self.metrics_file   = kwargs['metrics_file']
+        self.report_file    = kwargs['report_file']
+        self.profile        = kwargs['profile']
+
+    def journal_path(self, prefix):
+        return self.journal_file or f"/var/lib/incus-tools/snapshot-journal-{ prefix }.jsonl"
 
     def create_snapshot_name(self, prefix):
         now = datetime.datetime.now()
@@ -29,81 +70,109 @@ class IncusSnapper():
 
     # Instance
     def get_local_instances(self):
-        p = subprocess.run(["incus","list","-cn","-f","csv",self.filter ], capture_output=True, text=True)
-        return p.stdout.splitlines()
+        return self.client.list_instances(project=self.project, filters=self.filter)
 
     def _print_enabled_instances(self):
-        p = subprocess.run(["incus","list",self.filter ], capture_output=True, text=True)
-        print(p.stdout)
+        table_data =  [["Name", "Type", "State", "Snapshots"]]
+        table_data += [[instance['name'], instance['type'], instance['status'], len(instance['snapshots'] or [])] for instance in self.instances]
+        print_table(table_data)
 
-    async def _snap_instance(self, instance):
+    def _created_before(self, error):
+        # the snapshot name is unique to the run, an interrupted or timed out attempt already created it
+        return "already exists" in str(error)
 
-        proc = await asyncio.create_subprocess_exec("incus","snapshot","create",instance,self.snapshot_name,"--expiry",self.expiry,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await proc.communicate()
-        if proc.returncode == 0:
-            print(f"{instance}/{self.snapshot_name} expires in {self.expiry}")
-        else:
-            error = stderr.decode().strip()
-            raise RuntimeError(f"ERROR: {instance}: {error}")
+    async def _snap_instance(self, instance):
+        try:
+            try:
+                await asyncio.to_thread(self.client.create_instance_snapshot, None, instance['name'], self.snapshot_name, instance['project'], self.expiry)
+            except IncusError as error:
+                if not self._created_before(error):
+                    raise
+            instance['snapshots'] = (instance['snapshots'] or []) + [dict(name=self.snapshot_name, created_at=datetime.datetime.now(datetime.timezone.utc).isoformat())]
+            print(f"{instance['name']}/{self.snapshot_name} expires in {self.expiry}")
+        except IncusError as error:
+            raise RuntimeError(f"ERROR: {instance['name']}: {error}")
 
     # Storage
-    def get_local_pools(self):
-        p = subprocess.run(["incus","storage","list","-cn","-f","csv"], capture_output=True, text=True)
-        return p.stdout.splitlines()
-
-    def _get_custom_volumes(self,pool):
-        p = subprocess.run(["incus","storage","volume","list",pool,"-cn","-f","json","type=custom" ], capture_output=True, text=True)
-        json_data = json.loads(p.stdout.strip())
-        volumes = self._get_volume_filtered(json_data)
-        return volumes
-
-    def _get_volume_filtered(self,volume_data):
-        # snap enabled
-        volume_filtered = [v for v in volume_data if v.get('config',{}).get("user.auto-snapshot") == "true"]
-        # exclude snapshots
-        volumes_no_snaps = [v for v in volume_filtered if "/" not in v['name']]
-
-        volumes_dict = []
-        for volume in volumes_no_snaps:
-            name                = volume.get('name')
-            project             = volume.get('project')
-            content_type        = volume.get('content_type')
-
-            volume_snap_count   = self._get_source_volume_snap_count(volume_filtered,volume)
-            volumes_dict.append(dict(name=name,project=project,content_type=content_type,snaps=volume_snap_count))
-        return volumes_dict
-
-    def _get_source_volume_snap_count(self,volume_data,volume):
-        volume_name = volume.get('name')
-        volume_snaps = [v for v in volume_data if f"{ volume_name }/" in v['name']]
-        return len(volume_snaps)
+    def _get_custom_volumes(self):
+        return self.catalog.by_pool("user.auto-snapshot")
 
     def _print_volumes_pretty(self,pool,volumes):
         table_data =  [["Pool", "Project", "Name", "Content-Type", "Snapshots"]]
         table_data += [[pool, volume['project'], volume['name'], volume['content_type'], volume['snaps']] for volume in volumes]
-        col_widths = [max(len(str(row[i])) for row in table_data) for i in range(len(table_data[0]))]
-        print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
-        print("| " + " | ".join(str(cell).ljust(w) for cell, w in zip(table_data[0], col_widths)) + " |")
-        print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
-        for data in table_data[1:]:
-            print("| " + " | ".join(str(cell).ljust(w) for cell, w in zip(data, col_widths)) + " |")
-        print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
-
-    async def _snap_volume(self, pool, volume_name):
-        proc = await asyncio.create_subprocess_exec("incus","storage","volume","snapshot","create",pool,f"custom/{volume_name}", self.snapshot_name,"--expiry",self.expiry,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await proc.communicate()
-        if proc.returncode == 0:
+        print_table(table_data)
+
+    async def _snap_volume(self, pool, volume_name, project=None):
+        try:
+            try:
+                await asyncio.to_thread(self.client.create_volume_snapshot, None, pool, volume_name, self.snapshot_name, project, self.expiry)
+            except IncusError as error:
+                if not self._created_before(error):
+                    raise
+            self.catalog.add_snapshot(pool, volume_name, self.snapshot_name, project)
             print(f"{pool}/{volume_name}/{self.snapshot_name} expires in {self.expiry}")
-        else:
-            error = stderr.decode().strip()
+        except IncusError as error:
             raise RuntimeError(f"ERROR: {pool}/{volume_name}: {error}")
 
+    # Metrics
+    def report(self):
+        if self.profile:
+            table_data =  [["Operation", "Item", "Duration", "Return code"]]
+            table_data += [[o['operation'], o['item'], f"{ o['duration']:.2f}s", o['returncode']] for o in self.metrics.slowest(self.profile)]
+            print_table(table_data)
+        self.metrics.export(self.metrics_file, self.report_file)
+
+    # Workers
+    def _get_snap_items(self):
+        items = [dict(kind="instance", name=i['name'], key=f"instance/{ i['project'] }/{ i['name'] }", pool=(i.get('expanded_devices') or {}).get('root', {}).get('pool'),
+            snap=self._snap_instance, args=(i,)) for i in self.instances]
+        if self.snap_volumes:
+            items += [dict(kind="volume", name=f"{ pool }/{ v['name'] }", key=f"volume/{ pool }/{ v['project'] }/{ v['name'] }", pool=pool,
+                snap=self._snap_volume, args=(pool, v['name'], v['project'])) for pool, volumes in self._get_custom_volumes().items() for v in volumes]
+        # round robin over pools, so no pool gets all of its snapshots in one burst
+        queues = {}
+        for item in items:
+            queues.setdefault(item['pool'], []).append(item)
+        return [item for batch in itertools.zip_longest(*queues.values()) for item in batch if item]
+
+    def _pool_limit(self, pool):
+        return self.pool_jobs.get(pool, self.pool_jobs.get(None, self.jobs))
+
+    def _snapshot_exists(self, item):
+        if item['kind'] == "instance":
+            return any(s['name'] == self.snapshot_name for s in item['args'][0]['snapshots'] or [])
+        pool, name, project = item['args']
+        volume = self.catalog.volumes.get((pool, project or "default", name))
+        return bool(volume) and self.snapshot_name in volume.snapshots
+
+    async def _run_item(self, jobs, pool_jobs, item):
+        attempt = 0
+        while True:
+            async with pool_jobs[item['pool']], jobs:
+                attempt += 1
+                self.journal.begin(item['key'])
+                start = time.monotonic()
+                try:
+                    await item['snap'](*item['args'])
+                    ok, error = True, ""
+                except Exception as e:
+                    logging.error(e)
+                    ok, error = False, str(e)
+                latency = time.monotonic() - start
+            if ok or attempt > self.retries or not is_transient(error):
+                break
+            delay = backoff_delay(self.retry_backoff, attempt)
+            logging.warning(f"Retry { item['kind'] } { item['name'] } in { delay:g}s ({ attempt } of { self.retries } retries)")
+            await asyncio.sleep(delay)
+        self.journal.update(item['key'], status="done" if ok else "failed", error=error or None)
+        self.results.append(dict(kind=item['kind'], name=item['name'], pool=item['pool'], ok=ok, error=error, latency=latency))
+        self.metrics.item(item['kind'], item['name'], latency, ok)
+
+    def _print_report(self):
+        table_data =  [["Kind", "Name", "Pool", "Result", "Latency", "Error"]]
+        table_data += [[r['kind'], r['name'], r['pool'] or "", "ok" if r['ok'] else "failed", f"{ r['latency']:.2f}s", r['error'].splitlines()[-1] if r['error'] else ""] for r in self.results]
+        print_table(table_data)
+
     async def invoke(self):
         if self.verbose:
             logging.info("Debug: Running in Debug mode")
@@ -113,22 +182,260 @@ class IncusSnapper():
         if self.list_only:
             if self.instances:
                 self._print_enabled_instances()
-            for pool in self.pools:
-                volumes = self._get_custom_volumes(pool)
-                if volumes:
-                    self._print_volumes_pretty(pool,volumes)
+            for pool, volumes in self._get_custom_volumes().items():
+                self._print_volumes_pretty(pool,volumes)
             sys.exit(0)
 
-        # instance
-        tasks_instance_snap = [asyncio.create_task(self._snap_instance(instance)) for instance in self.instances]
-        await asyncio.gather(*tasks_instance_snap)
+        # a resumed run keeps the snapshot name of the interrupted one
+        resume = self.resume and self.journal.resumable and self.journal.run.get('prefix') == self.prefix
+        if resume:
+            self.snapshot_name = self.journal.run['snapshot_name']
+            logging.info(f"Resume run started { self.journal.run.get('started') } for { self.snapshot_name }")
+            self.journal.resume()
+        else:
+            if self.resume:
+                if self.journal.given_up():
+                    logging.warning(f"Give up { len(self.journal.given_up()) } items still outstanding after { MAX_RESUMES } resumed runs")
+                logging.info(f"No run with outstanding items in { self.journal.path }, start a new run")
+            self.journal.start(tool="snapshot", prefix=self.prefix, snapshot_name=self.snapshot_name)
+
+        failed = await self.snapshot_all(resume)
+        if self.retention:
+            failed += await self.prune()
+        self.journal.finish()
+        if failed:
+            sys.exit(1)
 
-        # storage
+    # Retention
+    async def prune(self):
+        targets = [dict(name=i['name'], project=i['project'], pool=None, snapshots=[s['name'] for s in i['snapshots'] or []]) for i in self.instances]
         if self.snap_volumes:
-            for pool in self.pools:
-                volumes = self._get_custom_volumes(pool)
-                tasks_storage_snap = [asyncio.create_task(self._snap_volume(pool,volume['name'])) for volume in volumes]
-                await asyncio.gather(*tasks_storage_snap)
+            targets += [dict(name=v.name, project=v.project, pool=v.pool, snapshots=list(v.snapshots)) for v in self.catalog.filtered("user.auto-snapshot")]
+        deletions = plan_deletions(self.retention, targets, self.prefix)
+        logging.info(f"Retention { self.retention } for { self.prefix }: delete { len(deletions) } snapshots")
+
+        results     = await delete_snapshots(self.client, deletions, self.jobs)
+        instances   = {(i['project'], i['name']): i for i in self.instances}
+        for r in results:
+            if r['ok'] and r['pool']:
+                self.catalog.remove_snapshot(r['pool'], r['name'], r['snapshot'], r['project'])
+            elif r['ok']:
+                instance = instances[(r['project'], r['name'])]
+                instance['snapshots'] = [s for s in instance['snapshots'] if s['name'] != r['snapshot']]
+        return [r for r in results if not r['ok']]
+
+    async def snapshot_all(self, resume=False):
+        # instances and volumes of all pools in one queue
+        self.results = []
+        items       = await asyncio.to_thread(self._get_snap_items)
+        if resume:
+            # only the outstanding items, an interrupted one may have got its snapshot already
+            outstanding, interrupted = self.journal.outstanding(), self.journal.interrupted()
+            for item in items:
+                if item['key'] in interrupted and self._snapshot_exists(item):
+                    self.journal.update(item['key'], status="done")
+            items = [item for item in items if item['key'] in outstanding and self.journal.status(item['key']) != "done"]
+        else:
+            self.journal.plan([item['key'] for item in items])
+        jobs        = asyncio.Semaphore(self.jobs)
+        pool_jobs   = {pool: asyncio.Semaphore(self._pool_limit(pool)) for pool in set(item['pool'] for item in items)}
+        await asyncio.gather(*[self._run_item(jobs, pool_jobs, item) for item in items])
+
+        if self.results:
+            self._print_report()
+        failed = [r for r in self.results if not r['ok']]
+        if failed:
+            logging.error(f"{ len(failed) } of { len(self.results) } snapshots failed")
+        return failed
+
+class CronSchedule():
+    ALIASES = {"@hourly": "0 * * * *", "@daily": "0 0 * * *", "@weekly": "0 0 * * 0", "@monthly": "0 0 1 * *", "@yearly": "0 0 1 1 *"}
+
+    def __init__(self, spec):
+        fields = self.ALIASES.get(spec.strip(), spec).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron spec needs 5 fields: { spec }")
+        self.spec = spec
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [self._parse(f, lo, hi) for f, (lo, hi) in zip(fields, [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)])]
+        self.weekdays = {d % 7 for d in self.weekdays} # 0 and 7 are sunday
+        self.any_day = "*" in (fields[2], fields[4])
+
+    def _parse(self, field, lo, hi):
+        values = set()
+        for part in field.split(","):
+            span, _, step = part.partition("/")
+            if span == "*":
+                start, end = lo, hi
+            elif "-" in span:
+                start, end = map(int, span.split("-"))
+            else:
+                start = end = int(span)
+                end = hi if step else end
+            if start < lo or end > hi or start > end:
+                raise ValueError(f"Cron field { field } out of range { lo }-{ hi }")
+            values.update(range(start, end + 1, int(step or 1)))
+        return values
+
+    def _day_matches(self, t):
+        day, weekday = t.day in self.days, t.isoweekday() % 7 in self.weekdays
+        return (day and weekday) if self.any_day else (day or weekday) # cron ORs day of month and day of week
+
+    def next(self, after):
+        t = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron spec { self.spec } never matches")
+
+class IncusSnapDaemon():
+    # Keeps the snapshot enabled instances in memory, updated from the lifecycle
+    # event stream, and snapshots them whenever one of the schedules is due.
+    def __init__(self, snapper, schedules, events=None):
+        self.snapper        = snapper
+        self.schedules      = schedules
+        self.events         = events or (lambda: snapper.client.events(project=snapper.project))
+        self.inventory      = {}
+        self.volumes_stale  = False
+        self._lock          = threading.Lock()
+        self._fire_lock     = asyncio.Lock()
+
+    @staticmethod
+    def load_schedules(path):
+        config = configparser.ConfigParser()
+        if not config.read(path):
+            raise ValueError(f"Could not read schedule file { path }")
+        return [dict(prefix=section, cron=CronSchedule(config[section]['cron']), expiry=config[section].get('expiry'),
+            include_volumes=config[section].getboolean('volumes', fallback=False),
+            retention=RetentionPolicy.parse(config[section]['retention']) if config[section].get('retention') else None) for section in config.sections()]
+
+    # Inventory
+    def refresh_instances(self):
+        instances = self.snapper.get_local_instances()
+        with self._lock:
+            self.inventory = {(i['project'], i['name']): i for i in instances}
+            self.volumes_stale = True
+        logging.info(f"Inventory: { len(instances) } snapshot enabled instances")
+
+    def _update_instance(self, project, name):
+        instance = self.snapper.client.get_instance(None, name, project)
+        enabled = instance and all(instance.get('expanded_config', {}).get(k) == v for k, v in self.snapper.filter.items())
+        with self._lock:
+            if enabled:
+                self.inventory[(project, name)] = instance
+            else:
+                self.inventory.pop((project, name), None)
+
+    def _update_snapshots(self, project, name, snapshot, action):
+        with self._lock:
+            instance = self.inventory.get((project, name))
+            if not instance:
+                return
+            snapshots = [s for s in instance['snapshots'] or [] if s['name'] != snapshot]
+            if action == "instance-snapshot-created":
+                snapshots.append(dict(name=snapshot, created_at=datetime.datetime.now(datetime.timezone.utc).isoformat()))
+            instance['snapshots'] = snapshots
+
+    def apply_event(self, event):
+        metadata    = event.get('metadata') or {}
+        action      = metadata.get('action', "")
+        source      = urllib.parse.urlsplit(metadata.get('source', ""))
+        project     = urllib.parse.parse_qs(source.query).get('project', [event.get('project') or "default"])[0]
+        path        = [urllib.parse.unquote(p) for p in source.path.split("/")]
+        # the inventory only holds the instances of one project, without --project the stream has only those of the current one
+        if self.snapper.project and project != self.snapper.project:
+            return
+        if action.startswith("instance-snapshot-") and len(path) > 5:
+            self._update_snapshots(project, path[3], path[5], action)
+        elif action.startswith("storage-volume-snapshot-") and len(path) > 8:
+            if action == "storage-volume-snapshot-created":
+                self.snapper.catalog.add_snapshot(path[3], path[6], path[8], project)
+            elif action == "storage-volume-snapshot-deleted":
+                self.snapper.catalog.remove_snapshot(path[3], path[6], path[8], project)
+        elif action.startswith("instance-") and len(path) > 3:
+            logging.debug(f"Event { action } for { path[3] }")
+            if action == "instance-renamed":
+                with self._lock:
+                    self.inventory.pop((project, (metadata.get('context') or {}).get('old_name')), None)
+            if action == "instance-deleted":
+                with self._lock:
+                    self.inventory.pop((project, path[3]), None)
+            elif action in ("instance-created", "instance-updated", "instance-renamed", "instance-restored"):
+                self._update_instance(project, path[3])
+        elif action.startswith("profile-") and action != "profile-created":
+            logging.debug(f"Event { action }, refresh all instances")
+            self.refresh_instances()
+        elif action.startswith("storage-volume-"):
+            with self._lock:
+                self.volumes_stale = True
+
+    def _watch_events(self):
+        while True:
+            try:
+                for event in self.events():
+                    self.apply_event(event)
+            except Exception as e:
+                logging.error(f"Event stream failed: { e }")
+            # events may have been missed while disconnected
+            time.sleep(5)
+            try:
+                self.refresh_instances()
+            except Exception as e:
+                logging.error(f"Could not refresh inventory: { e }")
+
+    # Schedules
+    async def fire(self, schedule):
+        async with self._fire_lock:
+            snapper = self.snapper
+            snapper.prefix          = schedule['prefix']
+            snapper.snapshot_name   = snapper.create_snapshot_name(schedule['prefix'])
+            snapper.expiry          = schedule['expiry']
+            snapper.snap_volumes    = schedule['include_volumes']
+            snapper.retention       = schedule['retention']
+            with self._lock:
+                snapper.instances = list(self.inventory.values())
+                if self.volumes_stale:
+                    snapper.catalog = VolumeCatalog(snapper.client, project=snapper.project)
+                    self.volumes_stale = False
+            logging.info(f"Run schedule { schedule['prefix'] } ({ schedule['cron'].spec })")
+            snapper.metrics.reset()
+            snapper.journal = RunJournal(snapper.journal_path(schedule['prefix']))
+            snapper.journal.start(tool="snapshot", prefix=schedule['prefix'], snapshot_name=snapper.snapshot_name)
+            # a failed schedule must neither end the daemon nor keep the next one from running
+            try:
+                await snapper.snapshot_all()
+                if snapper.retention:
+                    await snapper.prune()
+            except Exception as e:
+                logging.error(f"Schedule { schedule['prefix'] } failed: { e }")
+            finally:
+                snapper.journal.finish()
+                snapper.report()
+
+    async def run(self):
+        threading.Thread(target=self._watch_events, daemon=True).start()
+        self.refresh_instances()
+
+        now         = datetime.datetime.now()
+        next_runs   = [schedule['cron'].next(now) for schedule in self.schedules]
+        tasks       = set()
+        while True:
+            await asyncio.sleep(max(0, (min(next_runs) - datetime.datetime.now()).total_seconds()))
+            now = datetime.datetime.now()
+            for i, schedule in enumerate(self.schedules):
+                if next_runs[i] <= now:
+                    task = asyncio.create_task(self.fire(schedule))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    next_runs[i] = schedule['cron'].next(now)
 
 if __name__ == "__main__":
     _parser = argparse.ArgumentParser(description="Python script creating incus snapshots")
@@ -137,13 +444,61 @@ if __name__ == "__main__":
     _parser.add_argument('--expiry',type=str, required=False,
                 help="Snapshot lifetime, can be specified in minutes (M), hours (H), days (d), weeks (w), months (m) or years (y).")
     _parser.add_argument('--include-volumes',action="store_true", help="Also snapshot volumes configured with user.auto-snapshot=true property")
+    _parser.add_argument('--project', type=str, help="Snapshot the instances and volumes of following project instead of the current project of the incus client")
     _parser.add_argument('--list-enabled',action="store_true", help="List auto-snapshot enabled resources and exit")
+    _parser.add_argument('--client', choices=["cli", "api"], default="cli",
+                help="Talk to incus through the incus command (cli) or directly through the REST API (api)")
+    _parser.add_argument('--jobs', type=int, default=8, help="Maximum number of snapshots created at the same time")
+    _parser.add_argument('--pool-jobs', type=str, action="append", default=[],
+                help="Maximum number of snapshots created at the same time per storage pool, either N for all pools or POOL=N (repeatable)")
+    _parser.add_argument('--retention', type=str,
+                help="Delete snapshots of --prefix not covered by this policy after snapshotting, e.g. last=5,hourly=24,daily=7,weekly=4,monthly=12")
+    _parser.add_argument('--daemon', action="store_true", help="Keep running and snapshot according to the schedules of --schedule-file")
+    _parser.add_argument('--schedule-file', type=str, default="/etc/incus-auto-snapshot.schedule",
+                help="Schedules for --daemon, one [prefix] section each with cron, expiry and volumes")
+    _parser.add_argument('--journal-file', type=str,
+                help="File recording the progress of every item of the current run, for --resume (default: /var/lib/incus-tools/snapshot-journal-<prefix>.jsonl)")
+    _parser.add_argument('--resume', action="store_true",
+                help="Snapshot only the outstanding items of an interrupted run of the same --prefix, start a new run if there is none")
+    _parser.add_argument('--retries', type=int, default=2, help="Retry transient failures of a snapshot this many times")
+    _parser.add_argument('--retry-backoff', type=float, default=5, help="Seconds before the first retry, doubled for every further one")
+    _parser.add_argument('--metrics-file', type=str,
+                help="Write timings of all incus calls as prometheus node-exporter textfile (e.g. /var/lib/prometheus/node-exporter/incus_auto_snapshot.prom)")
+    _parser.add_argument('--report-file', type=str, help="Write a JSON report with the timings of all items and incus calls")
+    _parser.add_argument('--profile', type=int, metavar="N", help="Print the N slowest incus calls at the end")
     _parser.add_argument('--verbose',action="store_true", help="Verbose output")
     args    =   _parser.parse_args()
 
 
-    if (not args.list_enabled) and (not args.prefix and args.expiry):
+    if (not args.list_enabled) and (not args.daemon) and (not args.prefix and args.expiry):
         _parser.error("Wrong input, use incus-auto-snapshot --help")
 
+    if args.retention and not args.prefix:
+        _parser.error("When --retention, --prefix is required.")
+    try:
+        args.retention = RetentionPolicy.parse(args.retention) if args.retention else None
+    except ValueError as e:
+        _parser.error(str(e))
+    try:
+        args.pool_jobs = {(limit.rpartition("=")[0] or None): int(limit.rpartition("=")[2]) for limit in args.pool_jobs}
+    except ValueError:
+        _parser.error("--pool-jobs expects N or POOL=N")
+    if min([args.jobs, *args.pool_jobs.values()]) < 1:
+        _parser.error("--jobs and --pool-jobs must be at least 1.")
+    if args.retries < 0 or args.retry_backoff < 0:
+        _parser.error("--retries and --retry-backoff must not be negative.")
+
     snapper = IncusSnapper(**args.__dict__)
-    asyncio.run(snapper.invoke())
+    if args.daemon:
+        logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.INFO)
+        try:
+            schedules = IncusSnapDaemon.load_schedules(args.schedule_file)
+        except (ValueError, KeyError, configparser.Error) as e:
+            _parser.error(f"Invalid schedule file: { e }")
+        asyncio.run(IncusSnapDaemon(snapper, schedules).run())
+    else:
+        try:
+            asyncio.run(snapper.invoke())
+        finally:
+            if not args.list_enabled:
+                snapper.report()
@@ -3,6 +3,13 @@ wget -O /usr/local/bin/incus-auto-snapshot https://raw.githubusercontent.com/Chr
 chown root:incus-admin /usr/local/bin/incus-auto-snapshot
 chmod 0700 /usr/local/bin/incus-auto-snapshot
 
+
+# shared modules
+mkdir -p /usr/local/lib/incus-tools
+for module in incus_client incus_catalog incus_retention incus_metrics incus_journal incus_output; do
+    wget -O /usr/local/lib/incus-tools/$module.py https://raw.githubusercontent.com/ChrisStro/incus-tools/refs/heads/main/common/$module.py
+done
+
 # config file
 cat << EOF > /etc/incus-auto-snapshot.conf
 # 120 Minutes
@@ -0,0 +1,537 @@
+#!/usr/bin/python3
+
+import urllib.parse
+import http.server
+import socketserver
+import collections
+import threading
+import datetime
+import hashlib
+import base64
+import random
+import queue
+import struct
+import uuid
+import json
+import time
+import re
+
+# commands that change state, a plain failure rate only applies to these
+MUTATING = ("copy", "start", "stop", "delete", "snapshot create", "snapshot delete",
+    "storage volume copy", "storage volume delete", "storage volume snapshot create", "storage volume snapshot delete")
+
+def parse_rates(spec):
+    # 0.05 or 0.01,copy=2,storage volume copy=5 -> {"": 0.01, "copy": 2.0, ...}
+    rates = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        command, _, value = part.rpartition("=")
+        rates[command.strip()] = float(value)
+    return rates
+
+class FakeError(Exception):
+    pass
+
+class FakeIncus():
+    # In-memory stand-in for one or more incus servers, answering the subset of
+    # incus commands the tools use with the same output formats.
+    def __init__(self, servers, latency=None, failures=None, seed=None):
+        self.servers        = servers
+        self.latency        = latency or {}
+        self.failures       = failures or {}
+        self.random         = random.Random(seed)
+        self.invocations    = collections.Counter()
+        self.operations     = {}
+        self.drop_idle      = False
+        self._subscribers   = []
+        self._lock          = threading.Lock()
+
+    @staticmethod
+    def generate(remote="local", instances=10, volumes=5, snapshots=3, projects=1):
+        # Instances and custom volumes configured for replication and auto snapshots on remote,
+        # "local" always exists as replication target with the same pools.
+        config  = {"user.repl-instance": "true", "user.repl-volume": "true", "user.auto-snapshot": "true"}
+        created = datetime.datetime(2026, 1, 1, 23, 50, tzinfo=datetime.timezone.utc)
+        snaps   = [(f"incus-auto-snap-daily-{ (created + datetime.timedelta(days=d)).strftime('%H:%M:%S_%d-%m-%Y') }",
+            (created + datetime.timedelta(days=d)).isoformat()) for d in range(snapshots)]
+        servers = {"local": {"pools": ["default", "fast"], "instances": {}, "volumes": {}}}
+        server  = servers.setdefault(remote, {"pools": ["default", "fast"], "instances": {}, "volumes": {}})
+        for i in range(instances):
+            project = "default" if i % projects == 0 else f"project{ i % projects }"
+            server['instances'][(project, f"instance{ i }")] = {
+                "name": f"instance{ i }", "project": project, "type": "virtual-machine" if i % 5 == 0 else "container",
+                "status": "Running", "config": dict(config), "expanded_config": dict(config),
+                "expanded_devices": {"root": {"type": "disk", "path": "/", "pool": "default" if i % 2 else "fast"}},
+                "state": {"disk": {"root": {"usage": (i % 4 + 1) << 30}}},
+                "snapshots": [{"name": name, "created_at": at, "expires_at": None} for name, at in snaps],
+                "created_at": created.isoformat(), "profiles": ["default"],
+            }
+        for i in range(volumes):
+            pool = "default" if i % 2 else "fast"
+            server['volumes'][(pool, "default", f"volume{ i }")] = {
+                "name": f"volume{ i }", "pool": pool, "project": "default", "type": "custom", "content_type": "filesystem",
+                "config": dict(config), "created_at": created.isoformat(), "snapshots": [{"name": name, "created_at": at} for name, at in snaps],
+            }
+        return servers
+
+    # Command line
+    def _command(self, argv):
+        words = []
+        for arg in argv:
+            if arg.startswith("-") or ":" in arg or len(words) == 4:
+                break
+            words.append(arg)
+            if " ".join(words) not in ("storage", "storage volume", "storage volume snapshot", "snapshot"):
+                break
+        return "list" if words[:1] in (["ls"], ["list"]) else " ".join(words)
+
+    def _rate(self, rates, command, default_applies=True):
+        matches = [c for c in rates if c and (command == c or command.startswith(c + " "))]
+        if matches:
+            return rates[max(matches, key=len)]
+        return rates.get("", 0) if default_applies else 0
+
+    def handle(self, argv):
+        command = self._command(argv)
+        self.invocations[command] += 1
+        time.sleep(self._rate(self.latency, command))
+        if self.random.random() < self._rate(self.failures, command, command in MUTATING):
+            return 1, "", "Error: Simulated failure\n"
+        try:
+            with self._lock:
+                return 0, self._dispatch(list(argv)), ""
+        except FakeError as e:
+            return 1, "", f"Error: { e }\n"
+
+    def _options(self, args):
+        opts = dict(format=None, columns=None, project="default", target_project=None, config=[])
+        flags = {"--all-projects", "--force", "--force-local", "--stateless", "--refresh", "--refresh-exclude-older"}
+        rest = []
+        while args:
+            arg = args.pop(0)
+            if arg in flags:
+                opts[arg[2:].replace("-", "_")] = True
+            elif arg in ("-f", "--format", "-c", "--project", "--target-project", "--expiry", "--type"):
+                value = args.pop(0)
+                key = {"-f": "format", "--format": "format", "-c": "config" if "=" in value else "columns"}.get(arg, arg[2:].replace("-", "_"))
+                if key == "config":
+                    opts['config'].append(value)
+                else:
+                    opts[key] = value
+            elif arg.startswith("-f") and not arg.startswith("--"):
+                opts['format'] = arg[2:]
+            elif arg.startswith("-c") and not arg.startswith("--"):
+                opts['columns'] = arg[2:]
+            elif arg.startswith("--") and "=" in arg:
+                key, value = arg[2:].split("=", 1)
+                opts[key.replace("-", "_")] = value
+            else:
+                rest.append(arg)
+        return rest, opts
+
+    def _server(self, remote):
+        if remote not in self.servers:
+            raise FakeError(f"The remote \"{ remote }\" doesn't exist")
+        return self.servers[remote]
+
+    def _split(self, ref):
+        # remote:name/snapshot -> (remote, name/snapshot), snapshot names may contain ':' as well
+        remote, colon, name = ref.partition(":")
+        if colon and "/" not in remote:
+            return remote, name
+        return "local", ref
+
+    def _instance(self, server, project, name):
+        instance = server['instances'].get((project, name))
+        if instance is None:
+            raise FakeError("Instance not found")
+        return instance
+
+    def _output(self, opts, rows, names):
+        if opts['format'] == "json":
+            return json.dumps(rows)
+        return "".join(f"{ n }\n" for n in names)
+
+    def _volume_rows(self, volume):
+        rows = [{k: v for k, v in volume.items() if k != "snapshots"}]
+        rows += [dict(rows[0], name=f"{ volume['name'] }/{ s['name'] }", created_at=s['created_at']) for s in volume['snapshots']]
+        return rows
+
+    def _dispatch(self, argv):
+        args, opts = self._options(argv)
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        command = args.pop(0)
+
+        if command in ("ls", "list"):
+            remote = args.pop(0)[:-1] if args and args[0].endswith(":") else "local"
+            rows = [i for i in self._server(remote)['instances'].values() if opts.get('all_projects') or i['project'] == opts['project']]
+            for arg in args:
+                if "=" in arg:
+                    key, value = arg.split("=", 1)
+                    rows = [i for i in rows if (i['project'] if key == "project" else i['expanded_config'].get(key)) == value]
+                else:
+                    rows = [i for i in rows if re.search(arg, i['name'])]
+            return self._output(opts, rows, [i['name'] for i in rows])
+
+        if command == "snapshot":
+            sub, ref = args[0], args[1]
+            remote, name = self._split(ref)
+            instance = self._instance(self._server(remote), opts['project'], name)
+            if sub == "list":
+                return self._output(opts, instance['snapshots'], [s['name'] for s in instance['snapshots']])
+            if sub == "create":
+                if any(s['name'] == args[2] for s in instance['snapshots']):
+                    raise FakeError("Snapshot already exists")
+                instance['snapshots'].append({"name": args[2], "created_at": now, "expires_at": opts.get('expiry')})
+                return ""
+            if sub == "delete":
+                snapshots = [s for s in instance['snapshots'] if s['name'] != args[2]]
+                if len(snapshots) == len(instance['snapshots']):
+                    raise FakeError("Snapshot not found")
+                instance['snapshots'] = snapshots
+                return ""
+
+        if command in ("start", "stop"):
+            remote, name = self._split(args[0])
+            self._instance(self._server(remote), opts['project'], name)['status'] = "Running" if command == "start" else "Stopped"
+            return ""
+
+        if command == "delete":
+            remote, name = self._split(args[0])
+            server = self._server(remote)
+            self._instance(server, opts['project'], name)
+            del server['instances'][(opts['project'], name)]
+            return ""
+
+        if command == "copy":
+            source_remote, source = self._split(args[0])
+            target_remote, target = self._split(args[1])
+            source, _, snapshot = source.partition("/")
+            instance = self._instance(self._server(source_remote), opts['project'], source)
+            server   = self._server(target_remote)
+            project  = opts['target_project'] or opts['project']
+            if (project, target) in server['instances'] and not opts.get('refresh'):
+                raise FakeError("Instance already exists")
+            if snapshot and not any(s['name'] == snapshot for s in instance['snapshots']):
+                raise FakeError("Snapshot not found")
+            copy = json.loads(json.dumps(instance))
+            copy.update(name=target, project=project, status="Stopped", snapshots=[] if snapshot else copy['snapshots'])
+            for option in opts['config']:
+                key, value = option.split("=", 1)
+                copy['config'][key] = copy['expanded_config'][key] = value
+            server['instances'][(project, target)] = copy
+            return ""
+
+        if command == "remote" and args[0] in ("list", "ls"):
+            return json.dumps({r: {"Addr": f"https://{ r }:8443", "Protocol": "incus"} for r in self.servers if r != "local"})
+
+        if command == "storage" and args[0] in ("list", "ls"):
+            remote = args[1][:-1] if len(args) > 1 else "local"
+            pools = self._server(remote)['pools']
+            return self._output(opts, [{"name": p, "driver": "dir", "config": {}, "status": "Created"} for p in pools], pools)
+
+        if command == "project" and args[0] in ("list", "ls"):
+            server = self._server(args[1][:-1] if len(args) > 1 else "local")
+            projects = sorted({"default", *(i['project'] for i in server['instances'].values())})
+            return self._output(opts, [{"name": p, "config": {}, "description": ""} for p in projects], projects)
+
+        if command in ("profile", "network", "image") and args[0] in ("list", "ls"):
+            rows = {
+                "profile": [{"name": "default", "project": opts['project'], "config": {}, "devices": {"root": {"type": "disk", "path": "/", "pool": "default"}}}],
+                "network": [{"name": "incusbr0", "type": "bridge", "managed": True, "config": {"ipv4.address": "10.0.0.1/24"}}],
+                "image":   [{"fingerprint": "0123456789abcdef0123", "auto_update": True, "public": False, "properties": {"os": "Debian"}, "profiles": ["default"]}],
+            }[command]
+            return self._output(opts, rows, [r.get('name', r.get('fingerprint')) for r in rows])
+
+        if command == "storage" and args[0] == "volume":
+            return self._volume(args[1:], opts, now)
+
+        raise FakeError(f"Unsupported command { ' '.join(argv) }")
+
+    def _volume(self, args, opts, now):
+        sub = args.pop(0)
+        if sub in ("list", "ls"):
+            remote, pool = "local", None
+            if args and "=" not in args[0]:
+                remote, pool = self._split(args.pop(0))
+            volumes = self._server(remote)['volumes'].values()
+            rows = [r for v in volumes if pool in (None, "", v['pool']) and (opts.get('all_projects') or v['project'] == opts['project']) for r in self._volume_rows(v)]
+            for arg in args:
+                key, _, value = arg.partition("=")
+                rows = [r for r in rows if str(r.get(key)) == value]
+            return self._output(opts, rows, [r['name'] for r in rows])
+
+        if sub == "show":
+            remote, pool = self._split(args[0])
+            if (pool, opts['project'], args[1].split("/", 1)[-1]) not in self._server(remote)['volumes']:
+                raise FakeError("Storage volume not found")
+            return ""
+
+        if sub == "copy":
+            source_remote, source = self._split(args[0])
+            target_remote, target = self._split(args[1])
+            source_pool, source = source.split("/", 1)
+            target_pool, target = target.split("/", 1)
+            volume  = self._server(source_remote)['volumes'].get((source_pool, opts['project'], source))
+            server  = self._server(target_remote)
+            project = opts['target_project'] or opts['project']
+            if volume is None:
+                raise FakeError("Storage volume not found")
+            if (target_pool, project, target) in server['volumes'] and not opts.get('refresh'):
+                raise FakeError("Storage volume already exists")
+            copy = json.loads(json.dumps(volume))
+            copy.update(name=target, pool=target_pool, project=project)
+            server['volumes'][(target_pool, project, target)] = copy
+            return ""
+
+        if sub == "delete":
+            remote, pool = self._split(args[0])
+            if self._server(remote)['volumes'].pop((pool, opts['project'], args[1].split("/", 1)[-1]), None) is None:
+                raise FakeError("Storage volume not found")
+            return ""
+
+        if sub == "snapshot":
+            action = args.pop(0)
+            remote, pool = self._split(args[0])
+            volume = self._server(remote)['volumes'].get((pool, opts['project'], args[1].split("/", 1)[-1]))
+            if volume is None:
+                raise FakeError("Storage volume not found")
+            if action in ("list", "ls"):
+                return self._output(opts, volume['snapshots'], [s['name'] for s in volume['snapshots']])
+            if action == "create":
+                if any(s['name'] == args[2] for s in volume['snapshots']):
+                    raise FakeError("Snapshot already exists")
+                volume['snapshots'].append({"name": args[2], "created_at": now})
+                return ""
+            if action == "delete":
+                snapshots = [s for s in volume['snapshots'] if s['name'] != args[2]]
+                if len(snapshots) == len(volume['snapshots']):
+                    raise FakeError("Snapshot not found")
+                volume['snapshots'] = snapshots
+                return ""
+
+        raise FakeError(f"Unsupported command storage volume { sub }")
+
+    # Server
+    def serve(self, path):
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            # argv separated by NUL until EOF, answered with rc NUL stdout NUL stderr
+            def handle(self):
+                data = self.rfile.read().decode()
+                rc, stdout, stderr = fake.handle(data.split("\0") if data else [])
+                self.wfile.write(f"{ rc }\0{ stdout }\0{ stderr }".encode())
+
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    # REST API
+    def serve_api(self, path):
+        # Same servers over the REST API on a unix socket, remote "local" only.
+        # Changes run as background operations through the command handler, so
+        # latency and failure rates apply to them as well.
+        handler = type("Handler", (FakeAPIHandler,), {"fake": self})
+        server = socketserver.ThreadingUnixStreamServer(path, handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def emit(self, event):
+        # sent to every open /1.0/events stream, None ends the streams
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def lifecycle(self, action, source, project="default"):
+        query = f"?project={ project }" if project != "default" else ""
+        self.emit({"type": "lifecycle", "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(), "project": project,
+            "metadata": {"action": action, "source": f"{ source }{ query }", "context": {}}})
+
+    def run_operation(self, argv, event=None):
+        operation = {"id": str(uuid.uuid4()), "status": "Running", "status_code": 103, "err": "", "done": threading.Event()}
+        self.operations[operation['id']] = operation
+
+        def run():
+            rc, _, stderr = self.handle(argv)
+            operation.update(status="Success" if rc == 0 else "Failure", status_code=200 if rc == 0 else 400,
+                err=stderr.strip().removeprefix("Error: "))
+            if rc == 0 and event:
+                self.lifecycle(*event)
+            operation['done'].set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return operation
+
+class FakeAPIHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version    = "HTTP/1.1"
+    fake                = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, document):
+        data = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        # drop the keep-alive connection without telling the client, as an idle timeout would
+        self.close_connection = self.fake.drop_idle
+
+    def _sync(self, metadata):
+        self._send(200, {"type": "sync", "status": "Success", "status_code": 200, "metadata": metadata})
+
+    def _error(self, message, status=None):
+        status = status or (404 if re.search(r"not found|doesn't exist", message) else 400)
+        self._send(status, {"type": "error", "error": message, "error_code": status, "metadata": None})
+
+    def _async(self, argv, event=None):
+        operation = self.fake.run_operation(argv, event)
+        self._send(202, {"type": "async", "status": "Operation created", "status_code": 100, "operation": f"/1.0/operations/{ operation['id'] }",
+            "metadata": {"id": operation['id'], "status": operation['status']}})
+
+    def _cli(self, *argv):
+        rc, stdout, stderr = self.fake.handle(list(argv))
+        if rc != 0:
+            raise FakeError(stderr.strip().removeprefix("Error: "))
+        return json.loads(stdout) if stdout else None
+
+    def _route(self, method):
+        url     = urllib.parse.urlsplit(self.path)
+        query   = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+        path    = [urllib.parse.unquote(p) for p in url.path.strip("/").split("/")]
+        length  = int(self.headers.get("Content-Length") or 0)
+        body    = json.loads(self.rfile.read(length)) if length else {}
+        project = query.get('project') or "default"
+        scope   = ["--all-projects"] if query.get('all-projects') == "true" else ["--project", project]
+        route   = (method, *path[1:2], *["*"] * len(path[2:]))
+
+        if path[:2] == ["1.0", "operations"] and method == "GET":
+            operation = self.fake.operations.get(path[2])
+            if operation is None:
+                raise FakeError("Operation not found")
+            if path[3:] == ["wait"]:
+                operation['done'].wait(None if float(query.get('timeout', -1)) < 0 else float(query['timeout']))
+            return self._sync({k: v for k, v in operation.items() if k != "done"})
+
+        if route == ("GET", "events"):
+            return self._events(query.get('type', "").split(","), query.get('project'))
+
+        if route == ("GET", "instances"):
+            instances = self._cli("list", *scope, "-f", "json")
+            return self._sync(instances if int(query.get('recursion', 0)) else [f"/1.0/instances/{ i['name'] }" for i in instances])
+        if route == ("GET", "instances", "*"):
+            with self.fake._lock:
+                return self._sync(self.fake._instance(self.fake._server("local"), project, path[2]))
+        if route == ("GET", "instances", "*", "*") and path[3] == "snapshots":
+            return self._sync(self._cli("snapshot", "list", path[2], "--project", project, "-f", "json"))
+
+        source = f"/1.0/instances/{ urllib.parse.quote(path[2] if len(path) > 2 else body.get('name', ''), safe='') }"
+        if route == ("PUT", "instances", "*", "*") and path[3] == "state":
+            action = body['action']
+            return self._async([action, path[2], "--project", project, *(["--force"] if body.get('force') else [])],
+                ({"start": "instance-started", "stop": "instance-stopped"}[action], source, project))
+        if route == ("DELETE", "instances", "*"):
+            return self._async(["delete", path[2], "--project", project, "--force"], ("instance-deleted", source, project))
+        if route == ("POST", "instances") and body.get('source', {}).get('type') == "copy":
+            copy = body['source']
+            argv = ["copy", copy['source'], body['name'], "--project", copy.get('project') or "default", "--target-project", project]
+            argv += ["--refresh"] if copy.get('refresh') else []
+            argv += [arg for k, v in (body.get('config') or {}).items() for arg in ("-c", f"{ k }={ v }")]
+            return self._async(argv, ("instance-created", source, project))
+        if route == ("POST", "instances", "*", "*") and path[3] == "snapshots":
+            expiry = ["--expiry", body['expires_at']] if body.get('expires_at') else []
+            return self._async(["snapshot", "create", path[2], body['name'], "--project", project, *expiry],
+                ("instance-snapshot-created", f"{ source }/snapshots/{ urllib.parse.quote(body['name'], safe='') }", project))
+        if route == ("DELETE", "instances", "*", "*", "*") and path[3] == "snapshots":
+            return self._async(["snapshot", "delete", path[2], path[4], "--project", project],
+                ("instance-snapshot-deleted", f"{ source }/snapshots/{ urllib.parse.quote(path[4], safe='') }", project))
+
+        if route == ("GET", "storage-pools"):
+            return self._sync([f"/1.0/storage-pools/{ p }" for p in self.fake._server("local")['pools']])
+        if route == ("GET", "storage-volumes"):
+            return self._sync(self._cli("storage", "volume", "list", *scope, "-f", "json"))
+        if route == ("GET", "storage-pools", "*", "*") and path[3] == "volumes":
+            return self._sync(self._cli("storage", "volume", "list", path[2], *scope, "-f", "json"))
+
+        volume = f"/1.0/storage-pools/{ urllib.parse.quote(path[2] if len(path) > 2 else '', safe='') }/volumes/custom"
+        if path[3:5] == ["volumes", "custom"]:
+            if route == ("GET", "storage-pools", "*", "*", "*", "*"):
+                self._cli("storage", "volume", "show", path[2], f"custom/{ path[5] }", "--project", project)
+                with self.fake._lock:
+                    return self._sync(self.fake._server("local")['volumes'][(path[2], project, path[5])])
+            if route == ("POST", "storage-pools", "*", "*", "*") and body.get('source', {}).get('type') == "copy":
+                copy = body['source']
+                argv = ["storage", "volume", "copy", f"{ copy['pool'] }/{ copy['name'] }", f"{ path[2] }/{ body['name'] }",
+                    "--project", copy.get('project') or "default", "--target-project", project, *(["--refresh"] if copy.get('refresh') else [])]
+                return self._async(argv, ("storage-volume-created", f"{ volume }/{ urllib.parse.quote(body['name'], safe='') }", project))
+            if route == ("DELETE", "storage-pools", "*", "*", "*", "*"):
+                return self._async(["storage", "volume", "delete", path[2], f"custom/{ path[5] }", "--project", project],
+                    ("storage-volume-deleted", f"{ volume }/{ urllib.parse.quote(path[5], safe='') }", project))
+            if route == ("POST", "storage-pools", "*", "*", "*", "*", "*") and path[6] == "snapshots":
+                return self._async(["storage", "volume", "snapshot", "create", path[2], f"custom/{ path[5] }", body['name'], "--project", project],
+                    ("storage-volume-snapshot-created", f"{ volume }/{ urllib.parse.quote(path[5], safe='') }/snapshots/{ urllib.parse.quote(body['name'], safe='') }", project))
+            if route == ("DELETE", "storage-pools", "*", "*", "*", "*", "*", "*") and path[6] == "snapshots":
+                return self._async(["storage", "volume", "snapshot", "delete", path[2], f"custom/{ path[5] }", path[7], "--project", project],
+                    ("storage-volume-snapshot-deleted", f"{ volume }/{ urllib.parse.quote(path[5], safe='') }/snapshots/{ urllib.parse.quote(path[7], safe='') }", project))
+
+        self._error(f"Unsupported request { method } { url.path }", 404)
+
+    def _handle(self, method):
+        try:
+            self._route(method)
+        except FakeError as e:
+            self._error(str(e))
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    # Events
+    def _events(self, types, project=None):
+        key     = self.headers.get("Sec-WebSocket-Key", "")
+        accept  = base64.b64encode(hashlib.sha1((key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        subscriber = queue.Queue()
+        with self.fake._lock:
+            self.fake._subscribers.append(subscriber)
+        try:
+            while (event := subscriber.get()) is not None:
+                if (event.get('type') in types or types == [""]) and project in (None, event.get('project', "default")):
+                    self._frame(0x1, json.dumps(event).encode())
+            self._frame(0x8, b"")
+        finally:
+            with self.fake._lock:
+                self.fake._subscribers.remove(subscriber)
+            self.close_connection = True
+
+    def _frame(self, opcode, payload):
+        # server frames are never masked
+        if len(payload) < 126:
+            head = struct.pack("!BB", 0x80 | opcode, len(payload))
+        elif len(payload) < 1 << 16:
+            head = struct.pack("!BBH", 0x80 | opcode, 126, len(payload))
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, len(payload))
+        self.wfile.write(head + payload)
+        self.wfile.flush()
@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+
+import subprocess
+import tempfile
+import resource
+import argparse
+import logging
+import runpy
+import json
+import time
+import sys
+import os
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path[0:0] = [BENCHMARK_DIR, os.path.join(BENCHMARK_DIR, "..", "common")]
+from fake_incus import FakeIncus, parse_rates
+from incus_output import print_table
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(levelname)s] %(asctime)s - %(message)s',
+    datefmt='%d-%m-%Y %H:%M:%S'
+)
+
+TOOLS = {
+    "repl":     os.path.join(BENCHMARK_DIR, "..", "repl-instance", "incus-repl-instance.py"),
+    "snapshot": os.path.join(BENCHMARK_DIR, "..", "auto-snapshot", "incus-auto-snapshot.py"),
+}
+
+def worker(script, result_file, *args):
+    # Runs inside the child process, so peak RSS is the tool's own
+    sys.argv = [script, *args]
+    start = time.monotonic()
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit:
+        pass
+    with open(result_file, "w") as f:
+        json.dump(dict(wall=time.monotonic() - start, rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss), f)
+
+class IncusBenchmark():
+    def __init__(self, **kwargs):
+        self.sizes          = [int(s) for s in kwargs['sizes'].split(",")]
+        self.tools          = kwargs['tools'].split(",")
+        self.volume_ratio   = kwargs['volumes_per_instance']
+        self.snapshots      = kwargs['snapshots']
+        self.projects       = kwargs['projects']
+        self.latency        = parse_rates(kwargs['latency'])
+        self.failures       = parse_rates(kwargs['failure_rate'])
+        self.jobs           = kwargs['jobs']
+        self.runs           = kwargs['runs']
+        self.seed           = kwargs['seed']
+        self.output         = kwargs['output']
+        self.baseline       = self._load_baseline(kwargs['baseline'])
+        self.verbose        = kwargs['verbose']
+        self.results        = []
+
+    def _load_baseline(self, path):
+        if not path:
+            return {}
+        with open(path) as f:
+            return {(r['tool'], r['instances'], r['run']): r for r in json.load(f)['results']}
+
+    def _tool_args(self, tool, run, tmp):
+        if tool == "repl":
+            return ["--source-server", "src", "--repl-prefix", "repl", "--target-custom-volume-pool", "default",
+                "--jobs", str(self.jobs), "--state-file", os.path.join(tmp, "repl-state.json"), "--journal-file", os.path.join(tmp, "repl-journal.jsonl")]
+        return ["--prefix", f"bench{ run }", "--expiry", "1d", "--include-volumes", "--jobs", str(self.jobs), "--journal-file", os.path.join(tmp, "snapshot-journal.jsonl")]
+
+    def _run_tool(self, tool, run, tmp, socket_path):
+        result_file = os.path.join(tmp, "result.json")
+        report_file = os.path.join(tmp, "report.json")
+        env = dict(os.environ, FAKE_INCUS_SOCKET=socket_path, PATH=f"{ BENCHMARK_DIR }:{ os.environ.get('PATH', '') }")
+        output = None if self.verbose else subprocess.DEVNULL
+        subprocess.run([sys.executable, os.path.realpath(__file__), "--worker", TOOLS[tool], result_file,
+            *self._tool_args(tool, run, tmp), "--report-file", report_file], env=env, stdout=output, stderr=output)
+        with open(result_file) as f:
+            result = json.load(f)
+        try:
+            with open(report_file) as f:
+                items = json.load(f)['items']
+        except (OSError, ValueError):
+            items = []
+        result.update(items=len(items), failed=sum(1 for i in items if not i['ok']))
+        return result
+
+    def bench(self, tool, instances):
+        volumes = int(instances * self.volume_ratio)
+        remote  = "src" if tool == "repl" else "local"
+        fake    = FakeIncus(FakeIncus.generate(remote, instances, volumes, self.snapshots, self.projects), self.latency, self.failures, self.seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            socket_path = os.path.join(tmp, "incus.socket")
+            server = fake.serve(socket_path)
+            try:
+                for run in range(1, self.runs + 1):
+                    logging.info(f"Run { run } of { tool } with { instances } instances and { volumes } volumes")
+                    fake.invocations.clear()
+                    result = self._run_tool(tool, run, tmp, socket_path)
+                    self.results.append(dict(result, tool=tool, instances=instances, volumes=volumes, run=run,
+                        invocations=sum(fake.invocations.values()), commands=dict(fake.invocations)))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def _compare(self, result):
+        base = self.baseline.get((result['tool'], result['instances'], result['run']))
+        if not base or not base['wall']:
+            return ""
+        return f"{ (result['wall'] / base['wall'] - 1) * 100:+.0f}%"
+
+    def _print_results(self):
+        table_data =  [["Tool", "Instances", "Volumes", "Run", "Items", "Failed", "Wall time", "Incus calls", "Peak RSS"] + (["vs. baseline"] if self.baseline else [])]
+        table_data += [[r['tool'], r['instances'], r['volumes'], r['run'], r['items'], r['failed'], f"{ r['wall']:.2f}s", r['invocations'], f"{ r['rss'] / 1024:.1f} MiB"]
+            + ([self._compare(r)] if self.baseline else []) for r in self.results]
+        print_table(table_data)
+
+    def invoke(self):
+        for tool in self.tools:
+            for instances in self.sizes:
+                self.bench(tool, instances)
+        self._print_results()
+        if self.output:
+            settings = dict(volumes_per_instance=self.volume_ratio, snapshots=self.snapshots, projects=self.projects,
+                latency=self.latency, failure_rate=self.failures, jobs=self.jobs, seed=self.seed)
+            with open(self.output, "w") as f:
+                json.dump(dict(settings=settings, results=self.results), f, indent=2)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--worker"]:
+        worker(*sys.argv[2:])
+        sys.exit(0)
+
+    _parser = argparse.ArgumentParser(description="Benchmark incus-repl-instance and incus-auto-snapshot against a simulated incus")
+    _parser.add_argument('--sizes', type=str, default="10,100,1000,10000", help="Comma separated numbers of instances to benchmark")
+    _parser.add_argument('--tools', type=str, default="repl,snapshot", help="Comma separated tools to benchmark (repl, snapshot)")
+    _parser.add_argument('--volumes-per-instance', type=float, default=0.5, help="Custom volumes per instance")
+    _parser.add_argument('--snapshots', type=int, default=3, help="Existing snapshots per instance and volume")
+    _parser.add_argument('--projects', type=int, default=1, help="Spread instances over this many projects")
+    _parser.add_argument('--latency', type=str, default="0",
+                help="Simulated seconds per incus call, either for all commands or per command (e.g. 0.01,copy=2,storage volume copy=1)")
+    _parser.add_argument('--failure-rate', type=str, default="0",
+                help="Probability of a failing incus call, a plain value applies to commands changing state (e.g. 0.01,snapshot create=0.05)")
+    _parser.add_argument('--jobs', type=int, default=8, help="Value for --jobs of the benchmarked tool")
+    _parser.add_argument('--runs', type=int, default=2, help="Consecutive runs per size, for repl the first run is the initial replication")
+    _parser.add_argument('--seed', type=int, help="Seed for simulated failures")
+    _parser.add_argument('--output', type=str, help="Write results as JSON, usable as --baseline later")
+    _parser.add_argument('--baseline', type=str, help="Compare wall times with the JSON results of an earlier run")
+    _parser.add_argument('--verbose', action="store_true", help="Show the output of the benchmarked tools")
+    args = _parser.parse_args()
+
+    unknown = set(args.tools.split(",")) - set(TOOLS)
+    if unknown:
+        _parser.error(f"Unknown tool { ', '.join(sorted(unknown)) }")
+    if args.projects < 1:
+        _parser.error("--projects must be at least 1")
+    try:
+        parse_rates(args.latency), parse_rates(args.failure_rate)
+    except ValueError:
+        _parser.error("Invalid --latency or --failure-rate, expected e.g. 0.01,copy=2")
+
+    IncusBenchmark(**args.__dict__).invoke()
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+import collections
+import threading
+import logging
+
+from incus_client import IncusError
+
+Volume = collections.namedtuple("Volume", ["pool", "project", "name", "content_type", "config", "snapshots", "used_by"], defaults=[()])
+
+class VolumeCatalog():
+    # Custom volumes of all pools, fetched lazily in one listing and grouped into
+    # parent volume -> snapshot names in a single pass over the entries.
+    def __init__(self, client, remote=None, project=None, all_projects=False):
+        self.client         = client
+        self.remote         = remote
+        self.project        = project
+        self.all_projects   = all_projects
+        self._volumes       = None
+        self._lock          = threading.Lock()
+
+    @property
+    def volumes(self):
+        with self._lock:
+            if self._volumes is None:
+                self._volumes = self._group(self._fetch())
+            return self._volumes
+
+    def _fetch(self):
+        logging.debug(f"Get custom volumes of all pools from { self.remote or 'local' }")
+        try:
+            return self.client.list_all_volumes(self.remote, self.project, self.all_projects)
+        except IncusError as e:
+            logging.debug(f"Listing all pools at once failed ({ e }), list pool by pool")
+            return [dict(v, pool=pool) for pool in self.client.list_pools(self.remote) for v in self.client.list_volumes(self.remote, pool, self.project, self.all_projects)]
+
+    def _group(self, entries):
+        volumes     = {}
+        snapshots   = collections.defaultdict(list)
+        for entry in entries:
+            name, _, snapshot = entry['name'].partition("/")
+            key = (entry.get('pool'), entry.get('project') or "default", name)
+            if snapshot:
+                snapshots[key].append(snapshot)
+            else:
+                volumes[key] = Volume(key[0], key[1], name, entry.get('content_type'), entry.get('config') or {}, snapshots[key], tuple(entry.get('used_by') or ()))
+        return volumes
+
+    def filtered(self, config_key, value="true"):
+        return [v for v in self.volumes.values() if v.config.get(config_key) == value]
+
+    def by_pool(self, config_key, value="true"):
+        pools = {}
+        for volume in self.filtered(config_key, value):
+            pools.setdefault(volume.pool, []).append(dict(name=volume.name, project=volume.project, content_type=volume.content_type, snaps=len(volume.snapshots)))
+        return pools
+
+    def exists(self, pool, name, project="default"):
+        return (pool, project, name) in self.volumes
+
+    def add(self, pool, name, project="default", content_type=None, config=None):
+        volumes = self.volumes
+        with self._lock:
+            volumes.setdefault((pool, project, name), Volume(pool, project, name, content_type, config or {}, []))
+
+    def remove(self, pool, name, project="default"):
+        with self._lock:
+            (self._volumes or {}).pop((pool, project, name), None)
+
+    def add_snapshot(self, pool, name, snapshot, project="default"):
+        with self._lock:
+            volume = (self._volumes or {}).get((pool, project, name))
+            if volume and snapshot not in volume.snapshots:
+                volume.snapshots.append(snapshot)
+
+    def remove_snapshot(self, pool, name, snapshot, project="default"):
+        with self._lock:
+            volume = (self._volumes or {}).get((pool, project, name))
+            if volume and snapshot in volume.snapshots:
+                volume.snapshots.remove(snapshot)
@@ -0,0 +1,407 @@
+#!/usr/bin/python3
+
+import subprocess
+import http.client
+import threading
+import datetime
+import calendar
+import socket
+import urllib.parse
+import logging
+import base64
+import struct
+import json
+import ssl
+import re
+import os
+
+class IncusError(RuntimeError):
+    def __init__(self, message, returncode=1):
+        super().__init__(message)
+        self.returncode = returncode
+
+def expiry_to_date(expiry, now=None):
+    # same syntax as "incus snapshot create --expiry": 120M, 3d, 4w, 3m, 1y, "1d 12H"
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    for value, unit in re.findall(r"(\d+)\s*([MHdwmy])", expiry or ""):
+        value = int(value)
+        if unit in "MHdw":
+            now += datetime.timedelta(**{ {"M": "minutes", "H": "hours", "d": "days", "w": "weeks"}[unit]: value })
+        else:
+            months = now.month - 1 + (value * 12 if unit == "y" else value)
+            year, month = now.year + months // 12, months % 12 + 1
+            now = now.replace(year=year, month=month, day=min(now.day, calendar.monthrange(year, month)[1]))
+    return now
+
+class IncusCLI():
+    def __init__(self, binary="incus"):
+        self.binary = binary
+
+    def _ref(self, remote, name=""):
+        return [f"{ remote }:{ name }"] if remote else ([name] if name else [])
+
+    def _project(self, project):
+        return ["--project", project] if project else []
+
+    def run(self, *args, check=True):
+        logging.debug(f"Run: incus { ' '.join(args) }")
+        p = subprocess.run([self.binary, *args], capture_output=True, text=True)
+        if check and p.returncode != 0:
+            raise IncusError(p.stderr.strip() or f"incus { args[0] } exited with { p.returncode }", p.returncode)
+        return p
+
+    def _json(self, *args):
+        p = self.run(*args)
+        if not p.stdout.strip():
+            raise IncusError(f"incus { args[0] } returned no output")
+        return json.loads(p.stdout)
+
+    # Instance
+    def list_instances(self, remote=None, project=None, all_projects=False, filters=None):
+        scope = ["--all-projects"] if all_projects else self._project(project)
+        return self._json("ls", *self._ref(remote), "-fjson", *scope, *[f"{ k }={ v }" for k, v in (filters or {}).items()])
+
+    def get_instance(self, remote, name, project=None):
+        instances = self._json("ls", *self._ref(remote), "-fjson", *self._project(project), f"^{ name }$")
+        return instances[0] if instances else None
+
+    def instance_exists(self, remote, name, project=None):
+        p = self.run("ls", *self._ref(remote), "-cn", "-fcsv", *self._project(project), f"^{ name }$")
+        return bool(p.stdout.strip())
+
+    def start_instance(self, remote, name, project=None):
+        self.run("start", *self._ref(remote, name), *self._project(project))
+
+    def stop_instance(self, remote, name, project=None):
+        self.run("stop", *self._ref(remote, name), *self._project(project))
+
+    def delete_instance(self, remote, name, project=None):
+        self.run("delete", *self._ref(remote, name), *self._project(project), "--force")
+
+    def copy_instance(self, source_remote, source, target, source_project=None, target_project=None, refresh=False, stateless=False, config=None):
+        args = ["copy", *self._ref(source_remote, source), target, *self._project(source_project)]
+        args += [f"--target-project={ target_project }"] if target_project else []
+        args += ["--refresh", "--refresh-exclude-older"] if refresh else []
+        args += ["--stateless"] if stateless else []
+        args += ["--force-local"] if not source_remote else []
+        for key, value in (config or {}).items():
+            args += ["-c", f"{ key }={ value }"]
+        self.run(*args)
+
+    # Instance snapshots
+    def list_instance_snapshots(self, remote, name, project=None):
+        return self._json("snapshot", "list", *self._ref(remote, name), *self._project(project), "-cn", "-fjson")
+
+    def create_instance_snapshot(self, remote, name, snapshot, project=None, expiry=None):
+        self.run("snapshot", "create", *self._ref(remote, name), snapshot, *self._project(project), *(["--expiry", expiry] if expiry else []))
+
+    def delete_instance_snapshot(self, remote, name, snapshot, project=None):
+        self.run("snapshot", "delete", *self._ref(remote, name), snapshot, *self._project(project))
+
+    # Storage
+    def list_pools(self, remote=None):
+        return self.run("storage", "list", *self._ref(remote), "-cn", "-f", "csv").stdout.splitlines()
+
+    def list_volumes(self, remote, pool, project=None, all_projects=False, volume_type="custom"):
+        scope = ["--all-projects"] if all_projects else self._project(project)
+        return self._json("storage", "volume", "list", *self._ref(remote, pool), *scope, "-cn", "-f", "json", f"type={ volume_type }")
+
+    def list_all_volumes(self, remote=None, project=None, all_projects=False, volume_type="custom"):
+        scope = ["--all-projects"] if all_projects else self._project(project)
+        return self._json("storage", "volume", "list", *self._ref(remote), *scope, "-f", "json", f"type={ volume_type }")
+
+    def volume_exists(self, remote, pool, name, project=None):
+        return self.run("storage", "volume", "show", *self._ref(remote, pool), f"custom/{ name }", *self._project(project), check=False).returncode == 0
+
+    def copy_volume(self, source_remote, source_pool, source, target_pool, target, source_project=None, target_project=None, refresh=False):
+        args = ["storage", "volume", "copy", *self._ref(source_remote, f"{ source_pool }/{ source }"), f"{ target_pool }/{ target }", *self._project(source_project)]
+        args += [f"--target-project={ target_project }"] if target_project else []
+        args += ["--refresh"] if refresh else []
+        self.run(*args)
+
+    def delete_volume(self, remote, pool, name, project=None):
+        self.run("storage", "volume", "delete", *self._ref(remote, pool), f"custom/{ name }", *self._project(project))
+
+    def create_volume_snapshot(self, remote, pool, volume, snapshot, project=None, expiry=None):
+        self.run("storage", "volume", "snapshot", "create", *self._ref(remote, pool), f"custom/{ volume }", snapshot, *self._project(project), *(["--expiry", expiry] if expiry else []))
+
+    def delete_volume_snapshot(self, remote, pool, volume, snapshot, project=None):
+        self.run("storage", "volume", "snapshot", "delete", *self._ref(remote, pool), f"custom/{ volume }", snapshot, *self._project(project))
+
+    # Entities (projects, profiles, images, networks, storage-pools) with all their fields
+    ENTITY_COMMANDS = {"projects": ["project"], "profiles": ["profile"], "images": ["image"], "networks": ["network"], "storage-pools": ["storage"]}
+
+    def list_entities(self, remote, entity, project=None):
+        return self._json(*self.ENTITY_COMMANDS[entity], "list", *self._ref(remote), "-fjson", *self._project(project))
+
+    # Remotes
+    def list_remotes(self):
+        return self._json("remote", "list", "-fjson")
+
+    # Events
+    def events(self, remote=None, types=("lifecycle",), project=None):
+        args = [self.binary, "monitor", *self._ref(remote), "--format", "json", *[f"--type={ t }" for t in types], *self._project(project)]
+        with subprocess.Popen(args, stdout=subprocess.PIPE, text=True) as p:
+            for line in p.stdout:
+                if line.strip():
+                    yield json.loads(line)
+            p.wait()
+        raise IncusError(f"incus monitor exited with { p.returncode }", p.returncode)
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+class IncusAPI():
+    # Talks to the REST API directly: local unix socket for the local server, one
+    # keep-alive HTTPS connection per worker thread and remote for everything else.
+    # Migrations between servers (copy) need the websocket negotiation the incus
+    # client already implements, so those are handed to the CLI backend.
+    def __init__(self, socket_path=None, remotes=None, config_dir=None, fallback=None):
+        incus_dir           = os.environ.get("INCUS_DIR", "/var/lib/incus")
+        self.socket_path    = socket_path or os.environ.get("INCUS_SOCKET") or os.path.join(incus_dir, "unix.socket")
+        self.config_dir     = config_dir or os.environ.get("INCUS_CONF") or os.path.expanduser("~/.config/incus")
+        self.remotes        = remotes
+        self.fallback       = fallback or IncusCLI()
+        self._local         = threading.local()
+        self._remotes_lock  = threading.Lock()
+
+    # Connections
+    def _remote_url(self, remote):
+        with self._remotes_lock:
+            if self.remotes is None:
+                self.remotes = {name: r['Addr'] for name, r in self.fallback.list_remotes().items()}
+        if remote not in self.remotes:
+            raise IncusError(f"Remote { remote } is not configured")
+        return self.remotes[remote]
+
+    def _ssl_context(self, remote):
+        server_cert = os.path.join(self.config_dir, "servercerts", f"{ remote }.crt")
+        if os.path.exists(server_cert):
+            context = ssl.create_default_context(cafile=server_cert)
+            context.check_hostname = False
+            context.verify_flags |= ssl.VERIFY_X509_PARTIAL_CHAIN
+        else:
+            context = ssl.create_default_context()
+        context.load_cert_chain(os.path.join(self.config_dir, "client.crt"), os.path.join(self.config_dir, "client.key"))
+        return context
+
+    def _new_connection(self, remote):
+        if not remote:
+            return UnixHTTPConnection(self.socket_path)
+        url = urllib.parse.urlsplit(self._remote_url(remote))
+        if url.scheme == "http":
+            return http.client.HTTPConnection(url.hostname, url.port or 80)
+        return http.client.HTTPSConnection(url.hostname, url.port or 8443, context=self._ssl_context(remote))
+
+    def _connection(self, remote):
+        connections = self._local.__dict__.setdefault("connections", {})
+        if remote not in connections:
+            connections[remote] = self._new_connection(remote)
+        return connections[remote]
+
+    def _drop_connection(self, remote):
+        connection = self._local.__dict__.get("connections", {}).pop(remote, None)
+        if connection:
+            connection.close()
+
+    def request(self, remote, method, path, body=None, query=None, wait=True):
+        query = {k: v for k, v in (query or {}).items() if v is not None}
+        if query:
+            path += ("&" if "?" in path else "?") + urllib.parse.urlencode(query)
+        data = json.dumps(body) if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+
+        for attempt in (1, 2):
+            connection = self._connection(remote)
+            reused = connection.sock is not None
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                response = connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError) as e:
+                self._drop_connection(remote)
+                # the server may close an idle keep-alive connection, retry once on a fresh one
+                if attempt == 2 or not reused:
+                    raise IncusError(f"{ method } { path }: { e }")
+                logging.debug(f"Reconnect to { remote or 'local' } after { e }")
+            except OSError as e:
+                self._drop_connection(remote)
+                raise IncusError(f"{ method } { path }: { e }")
+
+        try:
+            document = json.loads(payload)
+        except ValueError:
+            raise IncusError(f"{ method } { path }: HTTP { response.status }")
+        if document.get("type") == "error":
+            raise IncusError(document.get("error") or f"HTTP { response.status }", document.get("error_code") or response.status)
+        if document.get("type") == "async" and wait:
+            return self.wait_operation(remote, document['operation'])
+        return document.get("metadata")
+
+    def wait_operation(self, remote, operation):
+        path, _, query = operation.partition("?")
+        op = self.request(remote, "GET", f"{ path }/wait?{ query }" if query else f"{ path }/wait", query={"timeout": -1})
+        if op.get("status") != "Success":
+            raise IncusError(op.get("err") or f"Operation { path } finished with { op.get('status') }")
+        return op
+
+    def _scope(self, project=None, all_projects=False):
+        return {"all-projects": "true"} if all_projects else {"project": project}
+
+    def _quote(self, name):
+        return urllib.parse.quote(name, safe="")
+
+    # Instance
+    def list_instances(self, remote=None, project=None, all_projects=False, filters=None):
+        instances = self.request(remote, "GET", "/1.0/instances", query={"recursion": 2, **self._scope(project, all_projects)})
+        return [i for i in instances if all(i.get('expanded_config', {}).get(k) == v for k, v in (filters or {}).items())]
+
+    def get_instance(self, remote, name, project=None):
+        try:
+            return self.request(remote, "GET", f"/1.0/instances/{ self._quote(name) }", query={"project": project, "recursion": 1})
+        except IncusError as e:
+            if e.returncode == 404:
+                return None
+            raise
+
+    def instance_exists(self, remote, name, project=None):
+        try:
+            self.request(remote, "GET", f"/1.0/instances/{ self._quote(name) }", query={"project": project})
+            return True
+        except IncusError as e:
+            if e.returncode == 404:
+                return False
+            raise
+
+    def _state(self, remote, name, project, action, force=False):
+        self.request(remote, "PUT", f"/1.0/instances/{ self._quote(name) }/state", body={"action": action, "timeout": -1, "force": force}, query={"project": project})
+
+    def start_instance(self, remote, name, project=None):
+        self._state(remote, name, project, "start")
+
+    def stop_instance(self, remote, name, project=None):
+        self._state(remote, name, project, "stop")
+
+    def delete_instance(self, remote, name, project=None):
+        try:
+            self._state(remote, name, project, "stop", force=True)
+        except IncusError as e:
+            logging.debug(f"Stop before delete of { name }: { e }")
+        self.request(remote, "DELETE", f"/1.0/instances/{ self._quote(name) }", query={"project": project})
+
+    def copy_instance(self, source_remote, source, target, source_project=None, target_project=None, refresh=False, stateless=False, config=None):
+        if source_remote:
+            return self.fallback.copy_instance(source_remote, source, target, source_project, target_project, refresh, stateless, config)
+        body = {"name": target, "config": config or {}, "source": {"type": "copy", "source": source, "project": source_project or "default", "refresh": refresh, "refresh_exclude_older": refresh}}
+        self.request(None, "POST", "/1.0/instances", body=body, query={"project": target_project or source_project})
+
+    # Instance snapshots
+    def list_instance_snapshots(self, remote, name, project=None):
+        return self.request(remote, "GET", f"/1.0/instances/{ self._quote(name) }/snapshots", query={"recursion": 1, "project": project})
+
+    def create_instance_snapshot(self, remote, name, snapshot, project=None, expiry=None):
+        body = {"name": snapshot, **({"expires_at": expiry_to_date(expiry).isoformat()} if expiry else {})}
+        self.request(remote, "POST", f"/1.0/instances/{ self._quote(name) }/snapshots", body=body, query={"project": project})
+
+    def delete_instance_snapshot(self, remote, name, snapshot, project=None):
+        self.request(remote, "DELETE", f"/1.0/instances/{ self._quote(name) }/snapshots/{ self._quote(snapshot) }", query={"project": project})
+
+    # Storage
+    def list_pools(self, remote=None):
+        return [url.rsplit("/", 1)[-1] for url in self.request(remote, "GET", "/1.0/storage-pools")]
+
+    def list_volumes(self, remote, pool, project=None, all_projects=False, volume_type="custom"):
+        volumes = self.request(remote, "GET", f"/1.0/storage-pools/{ self._quote(pool) }/volumes", query={"recursion": 1, **self._scope(project, all_projects)})
+        return [v for v in volumes if v.get('type') == volume_type]
+
+    def list_all_volumes(self, remote=None, project=None, all_projects=False, volume_type="custom"):
+        volumes = self.request(remote, "GET", "/1.0/storage-volumes", query={"recursion": 1, **self._scope(project, all_projects)})
+        return [v for v in volumes if v.get('type') == volume_type]
+
+    def volume_exists(self, remote, pool, name, project=None):
+        try:
+            self.request(remote, "GET", f"/1.0/storage-pools/{ self._quote(pool) }/volumes/custom/{ self._quote(name) }", query={"project": project})
+            return True
+        except IncusError as e:
+            if e.returncode == 404:
+                return False
+            raise
+
+    def copy_volume(self, source_remote, source_pool, source, target_pool, target, source_project=None, target_project=None, refresh=False):
+        if source_remote:
+            return self.fallback.copy_volume(source_remote, source_pool, source, target_pool, target, source_project, target_project, refresh)
+        body = {"name": target, "type": "custom", "source": {"type": "copy", "pool": source_pool, "name": source, "project": source_project or "default", "refresh": refresh}}
+        self.request(None, "POST", f"/1.0/storage-pools/{ self._quote(target_pool) }/volumes/custom", body=body, query={"project": target_project or source_project})
+
+    def delete_volume(self, remote, pool, name, project=None):
+        self.request(remote, "DELETE", f"/1.0/storage-pools/{ self._quote(pool) }/volumes/custom/{ self._quote(name) }", query={"project": project})
+
+    def create_volume_snapshot(self, remote, pool, volume, snapshot, project=None, expiry=None):
+        body = {"name": snapshot, **({"expires_at": expiry_to_date(expiry).isoformat()} if expiry else {})}
+        self.request(remote, "POST", f"/1.0/storage-pools/{ self._quote(pool) }/volumes/custom/{ self._quote(volume) }/snapshots", body=body, query={"project": project})
+
+    def delete_volume_snapshot(self, remote, pool, volume, snapshot, project=None):
+        self.request(remote, "DELETE", f"/1.0/storage-pools/{ self._quote(pool) }/volumes/custom/{ self._quote(volume) }/snapshots/{ self._quote(snapshot) }", query={"project": project})
+
+    # Entities (projects, profiles, images, networks, storage-pools) with all their fields
+    def list_entities(self, remote, entity, project=None):
+        return self.request(remote, "GET", f"/1.0/{ entity }", query={"recursion": 1, "project": project})
+
+    # Events
+    def events(self, remote=None, types=("lifecycle",), project=None):
+        # minimal websocket client for /1.0/events, server frames are never masked
+        connection = self._new_connection(remote)
+        connection.connect()
+        try:
+            key = base64.b64encode(os.urandom(16)).decode()
+            query = urllib.parse.urlencode({"type": ",".join(types), **({"project": project} if project else {})})
+            connection.sock.sendall((f"GET /1.0/events?{ query } HTTP/1.1\r\nHost: { connection.host }\r\n"
+                f"Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: { key }\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+            reader = connection.sock.makefile("rb")
+            status = reader.readline()
+            if b" 101 " not in status:
+                raise IncusError(f"Could not subscribe to events: { status.decode().strip() }")
+            while reader.readline() not in (b"\r\n", b""):
+                pass
+
+            message = b""
+            while True:
+                fin, opcode, payload = self._read_frame(reader)
+                if opcode == 8:
+                    break
+                if opcode == 9:
+                    mask = os.urandom(4)
+                    connection.sock.sendall(bytes([0x8A, 0x80 | len(payload)]) + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload)))
+                elif opcode in (0, 1, 2):
+                    message += payload
+                    if fin:
+                        yield json.loads(message)
+                        message = b""
+        finally:
+            connection.close()
+        raise IncusError("Event stream closed by server")
+
+    def _read_frame(self, reader):
+        head = reader.read(2)
+        if len(head) < 2:
+            raise IncusError("Event stream closed")
+        length = head[1] & 0x7f
+        if length == 126:
+            length = struct.unpack("!H", reader.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", reader.read(8))[0]
+        mask = reader.read(4) if head[1] & 0x80 else None
+        payload = reader.read(length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return head[0] & 0x80, head[0] & 0x0f, payload
+
+def get_client(backend="cli"):
+    return IncusAPI() if backend == "api" else IncusCLI()
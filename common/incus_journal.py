@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+
+import threading
+import datetime
+import logging
+import json
+import re
+import os
+
+# failures that come back on every attempt, anything else (timeouts, lost connections, busy storage) is retried
+PERMANENT = re.compile(r"not found|doesn't exist|does not exist|already exists|permission denied|forbidden|invalid", re.IGNORECASE)
+
+def is_transient(error):
+    return not PERMANENT.search(str(error))
+
+# resumed runs of one journal, afterwards its failed and deferred items are given up so
+# a broken item cannot keep every later --resume from starting a new run
+MAX_RESUMES = 3
+
+def backoff_delay(base, attempt):
+    # 1st retry after base seconds, then doubling
+    return base * 2 ** (attempt - 1)
+
+class RunJournal():
+    # Append-only record of one run: header lines with the run settings and one line
+    # per change of an item (planned, in-progress, done, failed), replayed on load.
+    # A run with items that are not done, because it was interrupted, deferred them
+    # or they failed, can be resumed.
+    def __init__(self, path):
+        self.path       = path
+        self._lock      = threading.Lock()
+        self._file      = None
+        self.run        = {}
+        self.items      = {}
+        self.load()
+
+    def _now(self):
+        return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def load(self):
+        self.run, self.items = {}, {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logging.warning(f"Journal { self.path } ends with an incomplete entry, ignored")
+                        break # last line of a killed run
+                    self._apply(entry)
+        except FileNotFoundError:
+            pass
+
+    def _apply(self, entry):
+        if 'key' in entry:
+            self.items.setdefault(entry['key'], {}).update({k: v for k, v in entry.items() if k != 'key'})
+        else:
+            self.run.update(entry)
+
+    @property
+    def resumable(self):
+        return bool(self.run) and bool(self.outstanding()) and self.run.get('resumes', 0) < MAX_RESUMES
+
+    def given_up(self):
+        return self.outstanding() if self.run.get('resumes', 0) >= MAX_RESUMES else set()
+
+    def status(self, key):
+        return self.items.get(key, {}).get('status')
+
+    def outstanding(self):
+        return {key for key, item in self.items.items() if item.get('status') != "done"}
+
+    def interrupted(self):
+        return {key: item for key, item in self.items.items() if item.get('status') == "in-progress"}
+
+    # Write
+    def _open(self, entries, mode):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._lock:
+            if self._file:
+                self._file.close()
+            # rewritten as a whole, never appended to a torn line
+            with open(f"{ self.path }.tmp", "w") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+            os.replace(f"{ self.path }.tmp", self.path)
+            self._file = open(self.path, mode)
+
+    def start(self, **header):
+        self.run, self.items = {}, {}
+        self._open([], "a")
+        self._append(dict(header, started=self._now()))
+
+    def resume(self):
+        # compacted to one line per item, then continued
+        self._open([self.run] + [dict(item, key=key) for key, item in self.items.items()], "a")
+        self._append(dict(resumed=self._now(), resumes=self.run.get('resumes', 0) + 1))
+
+    def _append(self, *entries):
+        with self._lock:
+            for entry in entries:
+                self._apply(entry)
+            if self._file:
+                # flushed per change, so the state survives the process being killed
+                self._file.writelines(json.dumps(entry) + "\n" for entry in entries)
+                self._file.flush()
+
+    def plan(self, keys):
+        now = self._now()
+        self._append(*[dict(key=key, status="planned", attempts=0, updated=now) for key in keys if key not in self.items])
+
+    def update(self, key, **values):
+        self._append(dict(values, key=key, updated=self._now()))
+
+    def begin(self, key, **values):
+        attempts = self.items.get(key, {}).get('attempts', 0) + 1
+        self.update(key, status="in-progress", attempts=attempts, **values)
+        return attempts
+
+    def finish(self):
+        self._append(dict(finished=self._now()))
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
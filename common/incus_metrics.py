@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+
+import contextlib
+import threading
+import datetime
+import logging
+import json
+import time
+import os
+
+from incus_client import IncusError
+
+BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200, 14400]
+
+# positional arguments after the remote that name the item of a client call
+ITEM_ARGS = {"copy_volume": 2, "volume_exists": 2, "delete_volume": 2, "create_volume_snapshot": 2, "delete_volume_snapshot": 2, "list_remotes": 0, "list_all_volumes": 0, "list_pools": 0}
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class MetricsRecorder():
+    def __init__(self, tool):
+        self.tool   = tool
+        self._lock  = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started    = time.time()
+            self.operations = []
+            self.items      = []
+
+    def record(self, operation, item, duration, returncode=0, size=None):
+        with self._lock:
+            self.operations.append(dict(operation=operation, item=item, duration=duration, returncode=returncode, bytes=size))
+
+    def item(self, kind, name, duration, ok):
+        with self._lock:
+            self.items.append(dict(kind=kind, name=name, duration=duration, ok=ok))
+
+    def slowest(self, count):
+        with self._lock:
+            return sorted(self.operations, key=lambda o: o['duration'], reverse=True)[:count]
+
+    # Export
+    def _labels(self, **labels):
+        return ",".join(f'{ k }="{ _escape(v) }"' for k, v in {"tool": self.tool, **labels}.items())
+
+    def prometheus(self):
+        with self._lock:
+            operations, items, started = list(self.operations), list(self.items), self.started
+        lines = [
+            "# HELP incus_tools_operation_duration_seconds Wall time of incus calls by operation type",
+            "# TYPE incus_tools_operation_duration_seconds histogram",
+        ]
+        for operation in sorted(set(o['operation'] for o in operations)):
+            durations = [o['duration'] for o in operations if o['operation'] == operation]
+            for le in BUCKETS:
+                lines.append(f"incus_tools_operation_duration_seconds_bucket{{{ self._labels(operation=operation, le=le) }}} { sum(1 for d in durations if d <= le) }")
+            lines.append(f"incus_tools_operation_duration_seconds_bucket{{{ self._labels(operation=operation, le='+Inf') }}} { len(durations) }")
+            lines.append(f"incus_tools_operation_duration_seconds_sum{{{ self._labels(operation=operation) }}} { sum(durations):.6f}")
+            lines.append(f"incus_tools_operation_duration_seconds_count{{{ self._labels(operation=operation) }}} { len(durations) }")
+        lines += ["# HELP incus_tools_operation_failures_total Failed incus calls by operation type", "# TYPE incus_tools_operation_failures_total counter"]
+        for operation in sorted(set(o['operation'] for o in operations)):
+            lines.append(f"incus_tools_operation_failures_total{{{ self._labels(operation=operation) }}} { sum(1 for o in operations if o['operation'] == operation and o['returncode']) }")
+        transferred = [o for o in operations if o['bytes'] is not None]
+        if transferred:
+            lines += ["# HELP incus_tools_transferred_bytes Data moved by copies where known", "# TYPE incus_tools_transferred_bytes gauge"]
+            lines += [f"incus_tools_transferred_bytes{{{ self._labels(operation=o['operation'], item=o['item']) }}} { o['bytes'] }" for o in transferred]
+        lines += ["# HELP incus_tools_item_duration_seconds Wall time per replicated or snapshotted item", "# TYPE incus_tools_item_duration_seconds gauge"]
+        lines += [f"incus_tools_item_duration_seconds{{{ self._labels(kind=i['kind'], item=i['name']) }}} { i['duration']:.6f}" for i in items]
+        lines += ["# HELP incus_tools_item_success Whether the item succeeded in the last run", "# TYPE incus_tools_item_success gauge"]
+        lines += [f"incus_tools_item_success{{{ self._labels(kind=i['kind'], item=i['name']) }}} { int(i['ok']) }" for i in items]
+        lines += [
+            "# HELP incus_tools_run_duration_seconds Wall time of the last run", "# TYPE incus_tools_run_duration_seconds gauge",
+            f"incus_tools_run_duration_seconds{{{ self._labels() }}} { time.time() - started:.6f}",
+            "# HELP incus_tools_run_timestamp_seconds Start of the last run", "# TYPE incus_tools_run_timestamp_seconds gauge",
+            f"incus_tools_run_timestamp_seconds{{{ self._labels() }}} { started:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        with self._lock:
+            return dict(tool=self.tool, started=datetime.datetime.fromtimestamp(self.started, datetime.timezone.utc).isoformat(),
+                duration=time.time() - self.started, items=list(self.items), operations=list(self.operations))
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # node-exporter may read at any time, never let it see a partial file
+        with open(f"{ path }.tmp", "w") as f:
+            f.write(content)
+        os.replace(f"{ path }.tmp", path)
+
+    def export(self, textfile=None, report_file=None):
+        try:
+            if textfile:
+                self._write(textfile, self.prometheus())
+            if report_file:
+                self._write(report_file, json.dumps(self.report(), indent=2))
+        except OSError as e:
+            logging.error(f"Could not write metrics: { e }")
+
+class InstrumentedClient():
+    # Wraps an incus client and records wall time and return code of every call
+    def __init__(self, client, recorder):
+        self.client     = client
+        self.recorder   = recorder
+        self._local     = threading.local()
+
+    @contextlib.contextmanager
+    def transfer_size(self, size):
+        # bytes moved by the copies of this thread within the block, where the caller knows them
+        self._local.size = size
+        try:
+            yield
+        finally:
+            self._local.size = None
+
+    def _operation(self, method, args, kwargs):
+        if method.startswith("list_") or method == "get_instance":
+            return "list"
+        if method.endswith("_exists"):
+            return "check"
+        if method.startswith("copy_"):
+            if not (args[0] if args else kwargs.get('source_remote')):
+                return "clone"
+            return "refresh" if kwargs.get('refresh') else "init"
+        return {"delete_instance": "purge", "delete_volume": "purge", "create_instance_snapshot": "snapshot", "create_volume_snapshot": "snapshot",
+            "delete_instance_snapshot": "snapshot-delete", "delete_volume_snapshot": "snapshot-delete"}.get(method, method)
+
+    def __getattr__(self, method):
+        func = getattr(self.client, method)
+        if not callable(func) or method in ("events", "run", "request"):
+            return func
+
+        def timed(*args, **kwargs):
+            item        = "/".join(str(a) for a in args[1:1 + ITEM_ARGS.get(method, 1)] if a)
+            operation   = self._operation(method, args, kwargs)
+            start       = time.monotonic()
+            returncode  = 0
+            try:
+                return func(*args, **kwargs)
+            except IncusError as e:
+                returncode = e.returncode or 1
+                raise
+            finally:
+                size = getattr(self._local, "size", None) if method.startswith("copy_") else None
+                self.recorder.record(operation, item, time.monotonic() - start, returncode, size)
+        return timed
@@ -0,0 +1,11 @@
+#!/usr/bin/python3
+
+def print_table(table_data):
+    # first row is the header, every cell is printed with str()
+    col_widths = [max(len(str(row[i])) for row in table_data) for i in range(len(table_data[0]))]
+    print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
+    print("| " + " | ".join(str(cell).ljust(w) for cell, w in zip(table_data[0], col_widths)) + " |")
+    print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
+    for data in table_data[1:]:
+        print("| " + " | ".join(str(cell).ljust(w) for cell, w in zip(data, col_widths)) + " |")
+    print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
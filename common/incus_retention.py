@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+import datetime
+import asyncio
+import logging
+import re
+
+from incus_client import IncusError
+
+SNAPSHOT_NAME   = re.compile(r"incus-auto-snap-(?P<prefix>.*)-(?P<time>\d{2}:\d{2}:\d{2}_\d{2}-\d{2}-\d{4})")
+SNAPSHOT_TIME   = "%H:%M:%S_%d-%m-%Y"
+
+def snapshot_time(name, prefix=None):
+    # incus-auto-snap-<prefix>-<HH:MM:SS_dd-mm-YYYY>, names do not sort by time
+    match = SNAPSHOT_NAME.fullmatch(name)
+    if not match or (prefix is not None and match['prefix'] != prefix):
+        return None
+    try:
+        return datetime.datetime.strptime(match['time'], SNAPSHOT_TIME)
+    except ValueError:
+        return None
+
+class RetentionPolicy():
+    BUCKETS = {"hourly": "%Y-%m-%d %H", "daily": "%Y-%m-%d", "weekly": "%G-%V", "monthly": "%Y-%m", "yearly": "%Y"}
+
+    def __init__(self, last=0, **buckets):
+        unknown = set(buckets) - set(self.BUCKETS)
+        if unknown:
+            raise ValueError(f"Unknown retention bucket { ', '.join(sorted(unknown)) }")
+        self.last       = last
+        self.buckets    = {bucket: count for bucket, count in buckets.items() if count}
+        if not self.last and not self.buckets:
+            raise ValueError("Retention policy would not keep any snapshot")
+
+    @classmethod
+    def parse(cls, spec):
+        # last=5,hourly=24,daily=7,weekly=4,monthly=12
+        try:
+            values = {key.strip(): int(value) for key, value in (part.split("=") for part in spec.split(",") if part.strip())}
+        except ValueError:
+            raise ValueError(f"Invalid retention policy { spec }, expected e.g. last=5,daily=7")
+        if min(values.values(), default=0) < 0:
+            raise ValueError(f"Invalid retention policy { spec }, counts must not be negative")
+        return cls(**values)
+
+    def __str__(self):
+        return ",".join(f"{ k }={ v }" for k, v in [("last", self.last), *self.buckets.items()] if v)
+
+    def split(self, snapshots):
+        # snapshots: [(name, datetime)] -> (keep, delete), newest first
+        ordered = sorted(snapshots, key=lambda s: s[1], reverse=True)
+        keep    = {name for name, _ in ordered[:self.last]}
+        for bucket, count in self.buckets.items():
+            periods = set()
+            for name, time in ordered:
+                if len(periods) >= count:
+                    break
+                period = time.strftime(self.BUCKETS[bucket])
+                if period not in periods:
+                    periods.add(period)
+                    keep.add(name)
+        return [n for n, _ in ordered if n in keep], [n for n, _ in ordered if n not in keep]
+
+def plan_deletions(policy, targets, prefix=None):
+    # targets: dicts describing an instance (pool=None) or volume, with 'snapshots' as names
+    deletions = []
+    for target in targets:
+        snapshots = [(name, snapshot_time(name, prefix)) for name in target['snapshots']]
+        _, delete = policy.split([s for s in snapshots if s[1]])
+        deletions += [dict(target, snapshot=name) for name in delete]
+    return deletions
+
+async def delete_snapshots(client, deletions, jobs=8):
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def delete(d):
+        async with semaphore:
+            try:
+                if d.get('pool'):
+                    await asyncio.to_thread(client.delete_volume_snapshot, d.get('remote'), d['pool'], d['name'], d['snapshot'], d.get('project'))
+                else:
+                    await asyncio.to_thread(client.delete_instance_snapshot, d.get('remote'), d['name'], d['snapshot'], d.get('project'))
+                logging.info(f"Deleted snapshot { d['name'] }/{ d['snapshot'] }")
+                return dict(d, ok=True, error="")
+            except IncusError as e:
+                logging.error(f"Could not delete snapshot { d['name'] }/{ d['snapshot'] }: { e }")
+                return dict(d, ok=False, error=str(e))
+
+    return await asyncio.gather(*[delete(d) for d in deletions])
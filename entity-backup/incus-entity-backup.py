@@ -0,0 +1,433 @@
+#!/usr/bin/python3
+
+import subprocess
+import threading
+import datetime
+import itertools
+import argparse
+import difflib
+import fnmatch
+import hashlib
+import tarfile
+import logging
+import asyncio
+import shutil
+import json
+import time
+import io
+import sys
+import os
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "common"), "/usr/local/lib/incus-tools"]
+from incus_client import IncusError, get_client
+from incus_output import print_table
+
+try:
+    import yaml
+except ImportError:
+    # JSON is valid YAML, incus reads both
+    yaml = None
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(levelname)s] %(asctime)s - %(message)s',
+    datefmt='%d-%m-%Y %H:%M:%S'
+)
+
+def to_yaml(document):
+    if yaml:
+        return yaml.safe_dump(document, default_flow_style=False, sort_keys=False, allow_unicode=True)
+    return json.dumps(document, indent=2) + "\n"
+
+class BackupDirectory():
+    # COMPRESS=no, the entity files are the backup
+    def __init__(self, path):
+        self.path = path
+
+    def add_dir(self, name):
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+
+    def add(self, name, data):
+        with open(os.path.join(self.path, name), "wb") as f:
+            f.write(data)
+
+    def add_file(self, name, source):
+        shutil.copyfile(source, os.path.join(self.path, name))
+
+    def close(self, ok=True):
+        pass
+
+class BackupArchive():
+    # Streams all entity files into one compressed tar, written to <path>.tmp and
+    # renamed when complete. gzip uses pigz and zstd the zstd command for
+    # compression on several threads, without pigz gzip runs in-process.
+    def __init__(self, path, compression, threads=0):
+        self.path       = path
+        self.mtime      = time.time()
+        self._file      = open(f"{ path }.tmp", "wb")
+        self._process   = None
+        threads         = threads or os.cpu_count() or 1
+        if compression == "zstd":
+            self._process = subprocess.Popen(["zstd", "-q", f"-T{ threads }"], stdin=subprocess.PIPE, stdout=self._file)
+        elif shutil.which("pigz"):
+            self._process = subprocess.Popen(["pigz", "-p", str(threads)], stdin=subprocess.PIPE, stdout=self._file)
+        if self._process:
+            self._tar = tarfile.open(fileobj=self._process.stdin, mode="w|")
+        else:
+            logging.debug("pigz not found, compress with a single thread")
+            self._tar = tarfile.open(fileobj=self._file, mode="w|gz")
+
+    def _info(self, name, type=tarfile.REGTYPE, mode=0o644, size=0):
+        info = tarfile.TarInfo(name)
+        info.type, info.mode, info.size, info.mtime = type, mode, size, self.mtime
+        return info
+
+    def add_dir(self, name):
+        self._tar.addfile(self._info(name, tarfile.DIRTYPE, 0o755))
+
+    def add(self, name, data):
+        self._tar.addfile(self._info(name, size=len(data)), io.BytesIO(data))
+
+    def add_file(self, name, source):
+        self._tar.add(source, arcname=name)
+
+    def close(self, ok=True):
+        try:
+            self._tar.close()
+            if self._process:
+                self._process.stdin.close()
+                if self._process.wait() != 0:
+                    ok = False
+                    logging.error(f"Compression of { self.path } exited with { self._process.returncode }")
+        finally:
+            self._file.close()
+        if ok:
+            os.replace(f"{ self.path }.tmp", self.path)
+        else:
+            os.remove(f"{ self.path }.tmp")
+        return ok
+
+class DedupStore():
+    # Content addressed backups: every distinct document is stored once below
+    # objects/<sha256>, each backup is a manifest mapping its paths to hashes.
+    def __init__(self, path):
+        self.path       = path
+        self.objects    = os.path.join(path, "objects")
+        self.manifests  = os.path.join(path, "manifests")
+
+    def _object(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path   = self._object(digest)
+        if os.path.exists(path):
+            # a fresh mtime protects reused objects from a concurrent garbage collection
+            os.utime(path)
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{ path }.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{ path }.tmp", path)
+        return digest
+
+    def read(self, digest):
+        with open(self._object(digest), "rb") as f:
+            return f.read()
+
+    def backups(self):
+        if not os.path.isdir(self.manifests):
+            return []
+        return sorted(n[:-len(".json")] for n in os.listdir(self.manifests) if n.startswith("incus-backup-") and n.endswith(".json"))
+
+    def load(self, name):
+        with open(os.path.join(self.manifests, f"{ name }.json")) as f:
+            return json.load(f)
+
+    def save(self, name, entities):
+        # never overwrites, a second backup within the same second is saved as <name>-1 and so on
+        os.makedirs(self.manifests, exist_ok=True)
+        for n in itertools.count():
+            candidate = f"{ name }-{ n }" if n else name
+            path = os.path.join(self.manifests, f"{ candidate }.json")
+            tmp  = f"{ path }.{ os.getpid() }.tmp"
+            if os.path.exists(path):
+                continue
+            with open(tmp, "w") as f:
+                json.dump(dict(name=candidate, created=datetime.datetime.now(datetime.timezone.utc).isoformat(), entities=dict(sorted(entities.items()))), f, indent=2)
+            try:
+                # unlike a rename, the link fails if a concurrent run took the name meanwhile
+                os.link(tmp, path)
+                return candidate
+            except FileExistsError:
+                continue
+            finally:
+                os.remove(tmp)
+
+    def resolve(self, spec):
+        # exact name, "latest" or the newest backup whose timestamp starts with spec (e.g. 2026-10-18)
+        backups = self.backups()
+        if spec == "latest" and backups:
+            return backups[-1]
+        matches = [b for b in backups if b == spec or b.startswith(f"incus-backup-{ spec }")]
+        if not matches:
+            raise ValueError(f"No backup matches { spec }")
+        return matches[-1]
+
+    def prune(self, keep, since):
+        backups = self.backups()
+        for name in backups[:-keep]:
+            logging.info(f"Delete backup { name }")
+            os.remove(os.path.join(self.manifests, f"{ name }.json"))
+        referenced = {digest for name in backups[-keep:] for digest in self.load(name)['entities'].values()}
+        removed = 0
+        for prefix in os.scandir(self.objects) if os.path.isdir(self.objects) else []:
+            for entry in os.scandir(prefix.path):
+                # objects touched during this run may belong to a backup still being written
+                if prefix.name + entry.name not in referenced and entry.stat().st_mtime < since:
+                    os.remove(entry.path)
+                    removed += 1
+        logging.info(f"Removed { removed } unreferenced objects")
+
+class DedupWriter():
+    # Same interface as BackupArchive, writing into a DedupStore
+    def __init__(self, store, name):
+        self.store      = store
+        self.name       = name
+        self.entities   = {}
+
+    def _path(self, name):
+        # paths in the manifest are relative to incus-backup-<timestamp>/
+        return name.split("/", 1)[1]
+
+    def add_dir(self, name):
+        pass
+
+    def add(self, name, data):
+        self.entities[self._path(name)] = self.store.put(data)
+
+    def add_file(self, name, source):
+        with open(source, "rb") as f:
+            self.add(name, f.read())
+
+    def close(self, ok=True):
+        if ok:
+            name = self.store.save(self.name, self.entities)
+            if name != self.name:
+                logging.warning(f"Backup { self.name } exists already, saved as { name }")
+        return ok
+
+class IncusEntityBackup():
+    def __init__(self, **kwargs):
+        self.client         = get_client(kwargs['client'])
+        self.keep           = kwargs['keep']
+        self.backup_dir     = kwargs['backup_dir']
+        self.compression    = {"yes": "gzip"}.get(kwargs['compress'], kwargs['compress'])
+        self.threads        = kwargs['threads']
+        self.jobs           = kwargs['jobs']
+        self.name           = f"incus-backup-{ datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') }"
+        self.started        = time.time()
+        self.store          = DedupStore(self.backup_dir)
+        self.archive        = None
+        self._lock          = threading.Lock()
+        self.failed         = []
+
+    # Fetch
+    def get_projects(self):
+        projects = [p['name'] for p in self.client.list_entities(None, "projects")]
+        return projects or ["default"]
+
+    def _instance_config(self, instance):
+        # same document as "incus config show --expanded"
+        return {
+            "architecture": instance.get('architecture'),
+            "config": instance.get('expanded_config', {}),
+            "devices": instance.get('expanded_devices', {}),
+            "ephemeral": instance.get('ephemeral', False),
+            "profiles": instance.get('profiles', []),
+            "stateful": instance.get('stateful', False),
+            "description": instance.get('description', ""),
+        }
+
+    def _image_config(self, image):
+        # same document as "incus image show"
+        return {key: image.get(key) for key in ("auto_update", "properties", "public", "expires_at", "profiles")}
+
+    def _get_volumes(self, project, pools):
+        try:
+            volumes = self.client.list_all_volumes(None, project)
+        except IncusError as e:
+            logging.debug(f"Listing all pools at once failed ({ e }), list pool by pool")
+            volumes = [dict(v, pool=pool['name']) for pool in pools for v in self.client.list_volumes(None, pool['name'], project)]
+        # snapshots are listed as <volume>/<snapshot>
+        return [v for v in volumes if "/" not in v['name']]
+
+    def get_entities(self, project, pools):
+        # one listing per entity type, in the order and with the file names of the shell version
+        files  = [(f"profile-{ p['name'] }.yaml", p) for p in self.client.list_entities(None, "profiles", project)]
+        files += [(f"instance-{ i['name'] }.yaml", self._instance_config(i)) for i in self.client.list_instances(None, project)]
+        files += [(f"image-{ i['fingerprint'][:12] }.yaml", self._image_config(i)) for i in self.client.list_entities(None, "images", project)]
+        files += [(f"network-{ n['name'] }.yaml", n) for n in self.client.list_entities(None, "networks", project)]
+        volumes = self._get_volumes(project, pools)
+        for pool in pools:
+            files.append((f"storage-pool-{ pool['name'] }.yaml", pool))
+            files += [(f"storage-volume-{ pool['name'] }_{ v['name'] }.yaml", v) for v in volumes if v.get('pool') == pool['name']]
+        return files
+
+    # Backup
+    async def backup_project(self, semaphore, project, pools):
+        async with semaphore:
+            logging.info(f"Backup project { project }")
+            try:
+                files = await asyncio.to_thread(self.get_entities, project, pools)
+            except IncusError as e:
+                logging.error(f"Backup of project { project } failed: { e }")
+                self.failed.append(project)
+                return
+            await asyncio.to_thread(self._write, project, files)
+            logging.info(f"Backup of project { project } finished ({ len(files) } entities)")
+
+    def _write(self, project, files):
+        documents = [(name, to_yaml(document).encode()) for name, document in files]
+        # one project at a time, the archive is a single stream
+        with self._lock:
+            self.archive.add_dir(f"{ self.name }/{ project }")
+            for name, data in documents:
+                self.archive.add(f"{ self.name }/{ project }/{ name }", data)
+
+    def _open(self):
+        if self.compression == "no":
+            return BackupDirectory(self.backup_dir)
+        if self.compression == "dedup":
+            return DedupWriter(self.store, self.name)
+        suffix = "tar.zst" if self.compression == "zstd" else "tar.gz"
+        return BackupArchive(os.path.join(self.backup_dir, f"{ self.name }.{ suffix }"), self.compression, self.threads)
+
+    def purge(self):
+        logging.info(f"Purge older backups based on KEEP: { self.keep }")
+        if self.compression == "dedup":
+            return self.store.prune(self.keep, self.started)
+        backups = [e for e in os.scandir(self.backup_dir) if e.name.startswith("incus-backup-") and not e.name.endswith(".tmp")]
+        for entry in sorted(backups, key=lambda e: e.stat().st_mtime, reverse=True)[self.keep:]:
+            logging.info(f"Delete backup { entry.name }")
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+    # Deduplicated backups
+    def list_backups(self):
+        table_data  =  [["Backup", "Entities", "Changed"]]
+        previous    = {}
+        for name in self.store.backups():
+            entities = self.store.load(name)['entities']
+            table_data.append([name, len(entities), sum(1 for path, digest in entities.items() if previous.get(path) != digest)])
+            previous = entities
+        print_table(table_data)
+
+    def _select(self, entities, match):
+        return {path: digest for path, digest in entities.items() if not match or fnmatch.fnmatch(path, match)}
+
+    def extract(self, spec, target, match=None):
+        name     = self.store.resolve(spec)
+        entities = self._select(self.store.load(name)['entities'], match)
+        if target == "-":
+            # single documents straight to stdout, e.g. for "incus init ... <"
+            sys.stdout.write("---\n".join(self.store.read(d).decode() for d in entities.values()))
+            return
+        for path, digest in entities.items():
+            file = os.path.join(target, name, path)
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(file, "wb") as f:
+                f.write(self.store.read(digest))
+        logging.info(f"Extracted { len(entities) } entities of { name } to { os.path.join(target, name) }")
+
+    def diff(self, old_spec, new_spec, match=None, patch=False):
+        old_name, new_name = self.store.resolve(old_spec), self.store.resolve(new_spec)
+        old = self._select(self.store.load(old_name)['entities'], match)
+        new = self._select(self.store.load(new_name)['entities'], match)
+        changes = [(path, "added" if path not in old else "removed" if path not in new else "modified")
+            for path in sorted(old.keys() | new.keys()) if old.get(path) != new.get(path)]
+        if not changes:
+            print(f"No changes between { old_name } and { new_name }")
+            return
+        print_table([["Entity", "Change"], *changes])
+        if patch:
+            for path, _ in changes:
+                before = self.store.read(old[path]).decode().splitlines(keepends=True) if path in old else []
+                after  = self.store.read(new[path]).decode().splitlines(keepends=True) if path in new else []
+                sys.stdout.writelines(difflib.unified_diff(before, after, f"{ old_name }/{ path }", f"{ new_name }/{ path }"))
+
+    async def invoke(self):
+        logging.info(f"Keep Copies   : { self.keep }")
+        logging.info(f"Backup dir    : { self.backup_dir }")
+        logging.info(f"Compression   : { self.compression }")
+
+        projects = self.get_projects()
+        # storage pools are global, every project gets a copy like before
+        pools    = self.client.list_entities(None, "storage-pools")
+
+        os.makedirs(self.backup_dir, exist_ok=True)
+        self.archive = self._open()
+        ok = False
+        try:
+            self.archive.add_dir(self.name)
+            semaphore = asyncio.Semaphore(self.jobs)
+            await asyncio.gather(*[self.backup_project(semaphore, project, pools) for project in projects])
+            for source in ("/etc/subuid", "/etc/subgid"):
+                if os.path.exists(source):
+                    self.archive.add_file(f"{ self.name }/{ os.path.basename(source) }", source)
+                else:
+                    logging.warning(f"{ source } not found, not included in backup")
+            ok = not self.failed
+        finally:
+            self.archive.close(ok)
+
+        if self.failed:
+            logging.error(f"Backup failed for projects { ', '.join(self.failed) }")
+            sys.exit(1)
+        logging.info("All project backups finished")
+        self.purge()
+
+if __name__ == "__main__":
+    _parser = argparse.ArgumentParser(description="Backup the configuration of all incus entities of all projects")
+    _parser.add_argument('keep', type=int, nargs="?", default=5, help="Number of backups to keep (default: 5)")
+    _parser.add_argument('backup_dir', type=str, nargs="?", default=os.path.expanduser("~/incus-entities"),
+                help="Directory for the backups (default: ~/incus-entities)")
+    _parser.add_argument('compress', type=str, nargs="?", default="yes", choices=["yes", "no", "gzip", "zstd", "dedup"],
+                help="yes/gzip for a tar.gz archive, zstd for a tar.zst archive, no for a plain directory, dedup for a deduplicated store (default: yes)")
+    _parser.add_argument('--threads', type=int, default=0, help="Compression threads, 0 uses all cores (default: 0)")
+    _parser.add_argument('--jobs', type=int, default=4, help="Number of projects fetched in parallel (default: 4)")
+    _parser.add_argument('--client', choices=["cli", "api"], default="cli",
+                help="Talk to incus through the incus command (cli) or directly through the REST API (api)")
+    # deduplicated store
+    _parser.add_argument('--list-backups', action="store_true", help="List the backups of the deduplicated store")
+    _parser.add_argument('--extract', type=str, metavar="BACKUP",
+                help="Restore a backup of the deduplicated store (name, timestamp prefix like 2026-10-18 or latest) to --target")
+    _parser.add_argument('--target', type=str, default=".", help="Directory for --extract, - writes the documents to stdout (default: .)")
+    _parser.add_argument('--diff', type=str, nargs=2, metavar=("OLD", "NEW"), help="Show which entities changed between two backups")
+    _parser.add_argument('--patch', action="store_true", help="With --diff, also print the changes as unified diff")
+    _parser.add_argument('--match', type=str, help="Only extract or diff entities matching this pattern (e.g. 'default/instance-*')")
+    _parser.add_argument('--verbose',action="store_true", help="Verbose output")
+    args = _parser.parse_args()
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.compress == "zstd" and not shutil.which("zstd"):
+        _parser.error("zstd compression needs the zstd command")
+    if args.keep < 1:
+        _parser.error("KEEP must be at least 1")
+
+    backup = IncusEntityBackup(**args.__dict__)
+    try:
+        if args.list_backups:
+            backup.list_backups()
+        elif args.extract:
+            backup.extract(args.extract, args.target, args.match)
+        elif args.diff:
+            backup.diff(*args.diff, args.match, args.patch)
+        else:
+            asyncio.run(backup.invoke())
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
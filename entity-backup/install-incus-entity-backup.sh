@@ -1,8 +1,14 @@
 # install incus-auto-snapshot
-wget -O /usr/local/bin/incus-entity-backup https://raw.githubusercontent.com/ChrisStro/incus-tools/refs/heads/main/entity-backup/incus-entity-backup.sh
+wget -O /usr/local/bin/incus-entity-backup https://raw.githubusercontent.com/ChrisStro/incus-tools/refs/heads/main/entity-backup/incus-entity-backup.py
 chown root:incus-admin /usr/local/bin/incus-entity-backup
 chmod 0700 /usr/local/bin/incus-entity-backup
 
+# shared modules
+mkdir -p /usr/local/lib/incus-tools
+for module in incus_client incus_output; do
+    wget -O /usr/local/lib/incus-tools/$module.py https://raw.githubusercontent.com/ChrisStro/incus-tools/refs/heads/main/common/$module.py
+done
+
 # create target directory
 if command -v zfs >/dev/null 2>&1; then
     ROOTDATASET=$(zfs list -Honame -d0|head -n1)
@@ -1,10 +1,28 @@
 #!/usr/bin/python3
 
-import subprocess
 import logging
-import json
 import argparse
+import json
+import asyncio
+import threading
+import datetime
+import statistics
+import urllib.parse
+import time
+import re
 import sys
+import os
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "common"), "/usr/local/lib/incus-tools"]
+from incus_client import IncusError, expiry_to_date, get_client
+from incus_catalog import VolumeCatalog
+from incus_retention import delete_snapshots
+from incus_metrics import MetricsRecorder, InstrumentedClient
+from incus_journal import RunJournal, is_transient, backoff_delay, MAX_RESUMES
+from incus_output import print_table
+
+# longest valid instance and storage volume name
+MAX_NAME = 63
 
 logging.basicConfig(
     level=logging.INFO,
@@ -12,240 +30,802 @@ logging.basicConfig(
     datefmt='%d-%m-%Y %H:%M:%S'
 )
 
+class TargetInventory():
+    # Instances of the local target project, fetched once per run and shared by
+    # all sources, indexed by name and by the replica a clone was created from.
+    # Updated in place after every copy and delete.
+    def __init__(self, client, project):
+        self.client         = client
+        self.project        = project
+        self._lock          = threading.Lock()
+        self.instances      = {}
+        self.clones         = {}
+        self.refresh()
+
+    def refresh(self):
+        logging.debug(f"Get inventory of project { self.project } on local target")
+        instances = self.client.list_instances(None, project=self.project)
+        with self._lock:
+            self.instances, self.clones = {}, {}
+            for instance in instances:
+                self._index(instance)
+
+    def _index(self, instance):
+        name = instance['name']
+        self.instances[name] = instance
+        if name.startswith("keep--") and len(name) > 26: # keep--<instance>-<19 chars of snapshot name>
+            self.clones.setdefault(name[6:-20], {})[name] = instance
+
+    def _unindex(self, name):
+        instance = self.instances.pop(name, None)
+        if instance:
+            for clones in self.clones.values():
+                clones.pop(name, None)
+
+    def add(self, instance):
+        with self._lock:
+            self._unindex(instance['name'])
+            self._index(instance)
+
+    def remove(self, name):
+        with self._lock:
+            self._unindex(name)
+
+    def exists(self, name):
+        return name in self.instances
+
+    def replica(self, replica_name):
+        return self.instances.get(replica_name)
+
+    def clones_of(self, instance_name):
+        with self._lock:
+            clones = list(self.clones.get(instance_name, {}).values())
+        return [c['name'] for c in sorted(clones, key=lambda c: c.get('created_at') or "")]
+
+def parse_deadline(spec, now=None):
+    # 06:00 -> next 06:00 local time, otherwise a duration like 4H or "1H 30M" from now
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", spec.strip())
+    if match:
+        local = now.astimezone()
+        deadline = local.replace(hour=int(match[1]), minute=int(match[2]), second=0, microsecond=0)
+        return deadline if deadline > local else deadline + datetime.timedelta(days=1)
+    deadline = expiry_to_date(spec, now)
+    if deadline <= now:
+        raise ValueError(f"Invalid deadline { spec }, expected HH:MM or a duration like 4H")
+    return deadline
+
+class SyncState():
+    # Persisted result of the last successful sync per item, kept in memory and
+    # written atomically at most every FLUSH_INTERVAL seconds and at the end of
+    # the run, so an aborted run keeps nearly all of what already succeeded.
+    FLUSH_INTERVAL = 60
+
+    def __init__(self, path):
+        self.path   = path
+        self._lock  = threading.Lock()
+        self.items  = self._load()
+        self._dirty = False
+        self._saved = time.monotonic()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logging.warning(f"Ignore unreadable state file { self.path }: { e }")
+            return {}
+
+    def get(self, key):
+        with self._lock:
+            return self.items.get(key)
+
+    def update(self, key, **values):
+        with self._lock:
+            self.items.setdefault(key, {}).update(values)
+            self._dirty = True
+            if time.monotonic() - self._saved > self.FLUSH_INTERVAL:
+                self._save()
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{ self.path }.tmp", "w") as f:
+            json.dump(self.items, f, sort_keys=True)
+        os.replace(f"{ self.path }.tmp", self.path)
+        self._dirty, self._saved = False, time.monotonic()
+
 class IncusReplicator():
     def __init__(self,**kwargs):
         # Source
-        self.source_server  = kwargs['source_server']
+        self.metrics        = MetricsRecorder("repl")
+        self.client         = InstrumentedClient(get_client(kwargs['client']), self.metrics)
+        self.sources        = kwargs['sources']
+        # replicas of several sources are namespaced by source, a single --source-server keeps its names
+        self.namespaced     = not kwargs['source_server']
         self.repl_prefix    = kwargs['repl_prefix']
         self.target_project = kwargs['target_project']
         # Snapshots
         self.clear_snaps    = kwargs['snap_name_to_clear']
         # Storage
-        self.source_pools   = self._get_source_pools()
+        self.source_volumes = {remote: VolumeCatalog(self.client, remote, all_projects=True) for remote in self.sources}
+        self.target_volumes = VolumeCatalog(self.client)
         self.target_pool    = kwargs['target_custom_volume_pool']
         # Replication
         self.filter         = "user.repl-instance=true"
-        self.instances      = self.get_source_instances()
+        self.instances      = []
+        self.presync        = kwargs['presync']
         # Clones
         self.keep           = kwargs['keep']
         self.keep_count     = kwargs['keep_count']
+        # Workers
+        self.jobs           = kwargs['jobs']
+        self.instance_jobs  = kwargs['instance_jobs'] or self.jobs
+        self.volume_jobs    = kwargs['volume_jobs'] or self.jobs
+        self.source_jobs    = kwargs['source_jobs'] or self.jobs
+        self.results        = []
+        # Target
+        self.inventory      = None
+        # Planner
+        self.sync_state     = SyncState(kwargs['state_file'])
+        self.incremental    = kwargs['incremental']
+        self.max_sync_age   = kwargs['max_sync_age']
+        self.plan_only      = kwargs['plan']
+        # Scheduler
+        self.deadline       = kwargs['deadline']
+        self.deferred       = []
+        # Journal
+        self.journal        = RunJournal(kwargs['journal_file'])
+        self.resume         = kwargs['resume']
+        self.retries        = kwargs['retries']
+        self.retry_backoff  = kwargs['retry_backoff']
         # Args
         self.list_only      = kwargs['list_sources']
         self.verbose        = kwargs['verbose']
+        # Metrics
+        self.metrics_file   = kwargs['metrics_file']
+        self.report_file    = kwargs['report_file']
+        self.profile        = kwargs['profile']
+
+    # Sources
+    def get_source_instances(self, remote):
+        logging.debug(f"Get list of all instances from { remote }")
+        try:
+            instances = self.client.list_instances(remote, all_projects=True, filters={"user.repl-instance": "true"})
+        except IncusError as e:
+            raise RuntimeError(f"ERROR: Could not get any instances on { remote }: { e }")
+        return [dict(instance, remote=remote) for instance in instances]
+
+    def _discover_source(self, remote):
+        instances = self.get_source_instances(remote)
+        self.source_volumes[remote].volumes # fetch the catalog in the same worker
+        return instances
+
+    async def discover(self, target=True):
+        # all sources and the shared view of the local target are listed concurrently
+        tasks = [asyncio.to_thread(self._discover_source, remote) for remote in self.sources]
+        if target:
+            tasks += [asyncio.to_thread(TargetInventory, self.client, self.target_project), asyncio.to_thread(lambda: self.target_volumes.volumes)]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for remote, result in zip(self.sources, results):
+            if isinstance(result, Exception):
+                logging.error(f"Discovery of { remote } failed: { result }")
+                self.results.append(dict(kind="source", name=remote, ok=False, error=str(result), duration=0))
+                del self.source_volumes[remote]
+            else:
+                self.instances += result
+        if target:
+            for result in results[len(self.sources):]:
+                if isinstance(result, Exception):
+                    raise result
+            self.inventory = results[len(self.sources)]
+
+    @staticmethod
+    def name_part(part):
+        # remote and project names may contain characters that are not valid in instance names
+        return re.sub(r"[^a-zA-Z0-9]+", "-", part).strip("-")
+
+    def _key(self, remote, project, name):
+        # <source>--<project>--<name>, source only with several sources and project only if not default
+        parts = ([remote] if self.namespaced else []) + ([project] if project and project != "default" else [])
+        return "--".join([self.name_part(part) for part in parts] + [name])
+
+    def _replica_name(self, remote, project, name):
+        return f"{ self.repl_prefix }--{ self._key(remote, project, name) }"
+
+    def _display(self, remote, name):
+        return f"{ remote }:{ name }" if self.namespaced else name
+
+    def _label(self, instance):
+        return self._display(instance['remote'], instance['name'])
 
     # Instance
-    def get_source_instances(self):
-        logging.debug(f"Get list of all instances from { self.source_server }")
-        p = subprocess.run(["incus","ls",f"{ self.source_server }:","-fjson","--all-projects","user.repl-instance=true"], capture_output=True, text=True)
-        if not p.stdout.strip():
-            raise RuntimeError(f"ERROR: Could not get any instances on { self.source_server }")
-        return json.loads(p.stdout)
-
     def _print_source_instances(self):
-        table_data =  [["Project", "Name", "Type", "Snapshots"]]
-        table_data += [[instance['project'], instance['name'], instance['type'], len(instance['snapshots'] or [])] for instance in self.instances]
-        col_widths = [max(len(str(row[i])) for row in table_data) for i in range(len(table_data[0]))]
-        print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
-        print("| " + " | ".join(str(cell).ljust(w) for cell, w in zip(table_data[0], col_widths)) + " |")
-        print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
-        for data in table_data[1:]:
-            print("| " + " | ".join(str(cell).ljust(w) for cell, w in zip(data, col_widths)) + " |")
-        print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
-
-    def _check_local_repl(self, instance_name):
-        logging.debug(f"Check if replicated instance already present")
-        p = subprocess.run(["incus","ls","-cn","-fcsv",f"{ self.repl_prefix }--{ instance_name }",f"--all-projects",f"project={ self.target_project }"], capture_output=True, text=True)
-        return bool(p.stdout.strip())
-
-    def _init_instance_repl(self, instance_name, instance_type):
-        if instance_type == "container":
-            logging.warning(f"Container { instance_name } must be stopped before initial replication")
-            subprocess.run(["incus","stop",f"{self.source_server}:{instance_name}"], capture_output=True, text=True)
-
-        logging.info(f"Initial replication for { instance_name }")
-        p = subprocess.run(["incus","copy",f"{self.source_server}:{instance_name}",f"{ self.repl_prefix}--{instance_name}",f"--target-project={ self.target_project }","--stateless","-c","boot.autostart=false"], capture_output=True, text=True)
-
-        if instance_type == "container":
-            logging.info(f"Starting { instance_name } after replication")
-            subprocess.run(["incus","start",f"{self.source_server}:{instance_name}"], capture_output=True, text=True)
+        table_data =  [["Source", "Project", "Name", "Type", "Snapshots"]]
+        table_data += [[instance['remote'], instance['project'], instance['name'], instance['type'], len(instance['snapshots'] or [])] for instance in self.instances]
+        print_table(table_data)
 
-        if p.returncode != 0:
-            raise RuntimeError(f"ERROR[INIT]: {instance_name}: {p.stderr}")
+    def _replica(self, instance):
+        return self.inventory.replica(self._replica_name(instance['remote'], instance['project'], instance['name']))
 
-    def _refresh_instance_repl(self, instance_name):
-        logging.info(f"Update replication for { instance_name }")
-        p = subprocess.run(["incus","copy",f"{self.source_server}:{instance_name}",f"{ self.repl_prefix}--{instance_name}",f"--target-project={ self.target_project }","--refresh","--refresh-exclude-older","-c","boot.autostart=false"], capture_output=True, text=True)
+    def _instance_key(self, instance):
+        return self._state_key(instance['remote'], "instance", instance['project'], instance['name'])
 
-        if p.returncode != 0:
-            raise RuntimeError(f"ERROR[REFRESH]: {instance_name}: {p.stderr}")
-
-    def repl_instance(self, instance):
-        instance_type = instance['type']
+    def _check_local_repl(self, instance):
+        logging.debug(f"Check if replicated instance already present")
+        return self._replica(instance) is not None
+
+    def _stop_for_repl(self, instance):
+        logging.warning(f"Container { self._label(instance) } must be stopped before initial replication")
+        # journaled first, an interrupted run must start it again
+        self.journal.update(self._instance_key(instance), stopped=True)
+        self._try(self.client.stop_instance, instance['remote'], instance['name'], instance['project'])
+        return time.monotonic()
+
+    def _start_after_repl(self, instance, stopped):
+        logging.info(f"Starting { self._label(instance) } after replication")
+        error = self._try(self.client.start_instance, instance['remote'], instance['name'], instance['project'])
+        if error:
+            logging.error(f"Could not start { self._label(instance) } after replication: { error }")
+        else:
+            self.journal.update(self._instance_key(instance), stopped=False)
+        downtime = time.monotonic() - stopped
+        logging.info(f"Downtime of { self._label(instance) }: { downtime:.1f}s")
+        self.metrics.record("downtime", self._display(instance['remote'], instance['name']), downtime)
+
+    def _copy_instance(self, instance, refresh=False):
+        # an initial copy moves the whole root disk, the size of a refresh delta is unknown
+        with self.client.transfer_size(None if refresh else self._instance_size(instance)):
+            return self._try(self.client.copy_instance, instance['remote'], instance['name'], self._replica_name(instance['remote'], instance['project'], instance['name']),
+                source_project=instance['project'], target_project=self.target_project, refresh=refresh, stateless=not refresh, config={"boot.autostart": "false"})
+
+    def _init_instance_repl(self, instance):
+        # containers are stopped for a consistent copy, stopped ones stay stopped
+        stop = instance['type'] == "container" and instance.get('status', "Running") == "Running"
+        if stop and self.presync:
+            return self._presync_instance_repl(instance)
+        stopped = self._stop_for_repl(instance) if stop else None
+
+        logging.info(f"Initial replication for { self._label(instance) }")
+        self.journal.update(self._instance_key(instance), step="init")
+        error = self._copy_instance(instance)
+
+        if stop:
+            self._start_after_repl(instance, stopped)
+
+        if error:
+            raise RuntimeError(f"ERROR[INIT]: { instance['name'] }: {error}")
+
+    def _presync_instance_repl(self, instance):
+        # Copy while the container keeps running, with a fresh temporary snapshot as common
+        # base on both sides, then stop it only for the final --refresh delta.
         instance_name = instance['name']
+        snapshot = f"incus-repl-presync-{ datetime.datetime.now().strftime('%Y%m%d%H%M%S') }"
+        logging.info(f"Pre-seed replication for { self._label(instance) } from temporary snapshot { snapshot }")
+        self.journal.update(self._instance_key(instance), step="init", presync_snapshot=snapshot)
+        error = self._try(self.client.create_instance_snapshot, instance['remote'], instance_name, snapshot, instance['project'])
+        if error:
+            raise RuntimeError(f"ERROR[PRESYNC]: {instance_name}: {error}")
+        try:
+            error = self._copy_instance(instance)
+            if error:
+                raise RuntimeError(f"ERROR[PRESYNC]: {instance_name}: {error}")
+            # the pre-seeded replica is kept if the delta fails, a retry only redoes the delta
+            self.journal.update(self._instance_key(instance), step="presync-delta")
+            self.inventory.add(dict(name=self._replica_name(instance['remote'], instance['project'], instance_name), project=self.target_project, type=instance['type'], snapshots=[], created_at=self._now()))
+            self._presync_delta(instance)
+        finally:
+            target = self._replica_name(instance['remote'], instance['project'], instance_name)
+            for remote, name, project in ((instance['remote'], instance_name, instance['project']), (None, target, self.target_project)):
+                error = self._try(self.client.delete_instance_snapshot, remote, name, snapshot, project)
+                if error and remote:
+                    logging.warning(f"Could not delete temporary snapshot { self._label(instance) }/{ snapshot }: { error }")
+            self.journal.update(self._instance_key(instance), presync_snapshot=None)
+
+    def _presync_delta(self, instance):
+        stopped = self._stop_for_repl(instance)
+        logging.info(f"Final delta replication for { self._label(instance) }")
+        error = self._copy_instance(instance, refresh=True)
+        self._start_after_repl(instance, stopped)
+        if error:
+            raise RuntimeError(f"ERROR[INIT]: { instance['name'] }: {error}")
+
+    def _refresh_instance_repl(self, instance):
+        logging.info(f"Update replication for { self._label(instance) }")
+        self.journal.update(self._instance_key(instance), step="refresh")
+        error = self._copy_instance(instance, refresh=True)
+
+        if error:
+            raise RuntimeError(f"ERROR[REFRESH]: { instance['name'] }: {error}")
 
-        logging.info(f"Invoke replication for {instance_name }")
-        [self._delete_snap(instance_name,s) for s in self._get_snap_by_name(instance_name)] if self.clear_snaps else False
-        self._refresh_instance_repl(instance_name) if self._check_local_repl(instance_name) else self._init_instance_repl(instance_name,instance_type)
+    def repl_instance(self, instance):
+        logging.info(f"Invoke replication for { self._label(instance) }")
+        presynced = (self.journal.items.get(self._instance_key(instance)) or {}).get('step') == "presync-delta"
+        if presynced and self._check_local_repl(instance) and instance['type'] == "container" and instance.get('status', "Running") == "Running":
+            self._presync_delta(instance)
+        elif self._check_local_repl(instance):
+            self._refresh_instance_repl(instance)
+        else:
+            self._init_instance_repl(instance)
+        self.journal.update(self._instance_key(instance), step="replicated")
+
+        # replica now carries the remaining source snapshots
+        snapshots = [s for s in instance['snapshots'] or [] if not (self.clear_snaps and self.clear_snaps in s['name'])]
+        replica = self._replica(instance) or dict(name=self._replica_name(instance['remote'], instance['project'], instance['name']), project=self.target_project, type=instance['type'], created_at=self._now())
+        self.inventory.add(dict(replica, snapshots=snapshots))
+
+    def _now(self):
+        return datetime.datetime.now(datetime.timezone.utc).isoformat()
 
     # Clones
-    def _get_clone_instance_snap(self,instance_name):
-        p = subprocess.run(["incus","snapshot","list",f"{ self.repl_prefix }--{ instance_name }","--project",self.target_project,"-cn","-fjson"], capture_output=True, text=True)
+    def _get_clone_instance_snap(self,instance):
         try:
-            json_data = json.loads(p.stdout.strip())
+            json_data = self._replica(instance)['snapshots'] or []
             all_snaps = [s['name'] for s in json_data if self.keep in s['name'] ]
             return all_snaps, all_snaps[-1] # return all and last
         except:
-            logging.debug(f"No snapshots available for { instance_name }")
+            logging.debug(f"No snapshots available for { self._label(instance) }")
             return 0,0
 
-    def _clone_instance_snap(self,instance_name,snap_name:str):
+    def _clone_instance_snap(self,instance,snap_name:str):
         short_snapname  = snap_name[-19:]
-        clone_name      =f"keep--{ instance_name }-{ short_snapname }".replace(":","-").replace("_","-")
+        clone_name      =f"keep--{ self._key(instance['remote'], instance['project'], instance['name']) }-{ short_snapname.replace(':','-').replace('_','-') }"
         try:
-            p = subprocess.run(["incus","ls",clone_name,"-fcsv","--all-projects"], capture_output=True, text=True)
-            if not p.stdout:
+            if not self.inventory.exists(clone_name):
                 logging.debug(f"Create { clone_name } from { snap_name }")
-                p = subprocess.run(["incus","copy",f"{ self.repl_prefix }--{ instance_name }/{ snap_name }",clone_name,"--project",self.target_project,"--target-project",self.target_project,"--force-local","-c","boot.autostart=false"],check=True, capture_output=True, text=True)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Could not clone snap, { e }, DETAILS: { e.stderr }")
+                self.journal.update(self._instance_key(instance), clone=clone_name)
+                self.client.copy_instance(None, f"{ self._replica_name(instance['remote'], instance['project'], instance['name']) }/{ snap_name }", clone_name, self.target_project, self.target_project, config={"boot.autostart": "false"})
+                self.inventory.add(dict(name=clone_name, project=self.target_project, snapshots=[], created_at=self._now()))
+                self.journal.update(self._instance_key(instance), clone=None)
+        except IncusError as e:
+            logging.error(f"Could not clone snap, DETAILS: { e }")
         except Exception as e:
             logging.error(f"Could not clone snap, { e }")
 
-    def _get_clone_instances(self,instance_name):
-        p = subprocess.run(["incus","list","-cn","-fjson","--all-projects"], capture_output=True, text=True)
-        try:
-            json_data = json.loads(p.stdout.strip())
-            all_clones = [s for s in json_data if f"keep--" in s['name'] ]
-            instance_clones = [c['name'] for c in all_clones if f"{ self.repl_prefix }--{ instance_name }" in c['name'] ]
-            return instance_clones
-        except:
-            logging.info(f"No clones available for { instance_name }")
-            return 0
+    def _get_clone_instances(self,instance):
+        instance_clones = self.inventory.clones_of(self._key(instance['remote'], instance['project'], instance['name']))
+        if not instance_clones:
+            logging.info(f"No clones available for { self._label(instance) }")
+        return instance_clones
 
     def _purge_instance_clones(self,instance_names: list[str]):
         try:
             for instance in instance_names:
                 logging.debug(f"Cleanup old clone: { instance }")
-                subprocess.run(["incus","delete",instance,"--project",self.target_project,"--force"],check=True, capture_output=True, text=True)
+                self.client.delete_instance(None, instance, self.target_project)
+                self.inventory.remove(instance)
         except:
             logging.error(f"Error on pruning { instance }")
 
     # snapshot management
-    def _get_snap_by_name(self,instance_name):
-        p = subprocess.run(["incus","snapshot","list",f"{self.source_server}:{instance_name}","-cn","-fjson"], capture_output=True, text=True)
-        json_data = json.loads(p.stdout.strip())
-        return [s['name'] for s in json_data if self.clear_snaps in s['name'] ]
-
-    def _delete_snap(self,instance_name,snap_name):
-        logging.info(f"Clear snapshots { snap_name } for { instance_name }")
-        p = subprocess.run(["incus","snapshot","delete",f"{self.source_server}:{instance_name}",snap_name], capture_output=True, text=True)
-        if p.returncode != 0:
-            raise RuntimeError(f"ERROR[CLEAR_SNAP]: {instance_name}: {p.stderr}")
-
-    def _check_snap_by_name(self,instance_name):
-        snaps = self._get_snap_by_name(instance_name)
-        return snaps if snaps else False
+    def _get_snaps_to_clear(self, instances):
+        return [dict(remote=i['remote'], pool=None, name=i['name'], project=i['project'], snapshot=s['name'])
+            for i in instances for s in i['snapshots'] or [] if self.clear_snaps in s['name']]
+
+    async def clear_snaps_bulk(self, instances):
+        deletions = self._get_snaps_to_clear(instances)
+        if not deletions:
+            return {}
+        logging.info(f"Clear { len(deletions) } snapshots containing { self.clear_snaps } on { len(instances) } instances")
+        results = await delete_snapshots(self.client, deletions, self.jobs)
+        return {(r['remote'], r['project'], r['name']): f"ERROR[CLEAR_SNAP]: { r['name'] }: { r['error'] }" for r in results if not r['ok']}
 
     # Storage
-    def _get_source_pools(self):
-        p = subprocess.run(["incus","storage","list",f"{self.source_server}:","-cn","-f","csv"], capture_output=True, text=True)
-        return p.stdout.splitlines()
-
-    def _get_source_volumes(self,pool):
-        p = subprocess.run(["incus","storage","volume","list",f"{ self.source_server }:{ pool }","-cn","-f","json","type=custom" ], capture_output=True, text=True)
-        json_data = json.loads(p.stdout.strip())
-        volume_rep_enabled = self._get_source_volume_filtered(json_data)
-        volumes_no_snaps = [v for v in volume_rep_enabled if "/" not in v['name']]
-
-        volumes_dict = []
-        for volume in volumes_no_snaps:
-            name                = volume.get('name')
-            project             = volume.get('project')
-            content_type        = volume.get('content_type')
-
-            volume_snap_count   = self._get_source_volume_snap_count(volume_rep_enabled,volume)
-            volumes_dict.append(dict(name=name,project=project,content_type=content_type,snaps=volume_snap_count))
-        return volumes_dict
-
-    def _get_source_volume_filtered(self,volume_data):
-        volume_filtered = [v for v in volume_data if v.get('config',{}).get("user.repl-volume") == "true"]
-        return volume_filtered
-
-    def _get_source_volume_snap_count(self,volume_data,volume):
-        volume_name = volume.get('name')
-        volume_snaps = [v for v in volume_data if f"{ volume_name }/" in v['name']]
-        return len(volume_snaps)
-
-    def _print_source_volumes_pretty(self,pool,volumes):
-        table_data =  [["Pool", "Project", "Name", "Content-Type", "Snapshots"]]
-        table_data += [[pool, volume['project'], volume['name'], volume['content_type'], volume['snaps']] for volume in volumes]
-        col_widths = [max(len(str(row[i])) for row in table_data) for i in range(len(table_data[0]))]
-        print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
-        print("| " + " | ".join(str(cell).ljust(w) for cell, w in zip(table_data[0], col_widths)) + " |")
-        print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
-        for data in table_data[1:]:
-            print("| " + " | ".join(str(cell).ljust(w) for cell, w in zip(data, col_widths)) + " |")
-        print("+" + "+".join("-" * (w + 2) for w in col_widths) + "+")
-
-    def _check_local_volumes(self, volume_name):
-        p = subprocess.run(["incus","storage","volume","list","-cn","-fcsv",self.target_pool,f"{ self.repl_prefix }--{ volume_name }",f"--all-projects"], capture_output=True, text=True)
-        return bool(p.stdout.strip())
-
-    def _init_volume_repl(self, source_pool, volume_name):
-        logging.info(f"Initial replication for storage volume { source_pool }/custom/{ volume_name }")
-        p = subprocess.run(["incus","storage","volume","copy",f"{ self.source_server }:{ source_pool }/{ volume_name }",f"{ self.target_pool}/{ self.repl_prefix }--{volume_name}"], capture_output=True, text=True)
-
-        if p.returncode != 0:
-            raise RuntimeError(f"ERROR[INIT]: { source_pool }/{ volume_name }: {p.stderr}")
-
-    def _refresh_volume_repl(self, source_pool, volume_name):
-        logging.info(f"Update replication for storage volume { source_pool }/custom/{ volume_name }")
-        p = subprocess.run(["incus","storage","volume","copy",f"{ self.source_server }:{ source_pool }/{ volume_name }",f"{ self.target_pool}/{ self.repl_prefix }--{volume_name}","--refresh"], capture_output=True, text=True)
-
-        if p.returncode != 0:
-            raise RuntimeError(f"ERROR[INIT]: { source_pool }/{ volume_name }: {p.stderr}")
-
-    def repl_volume(self, source_pool, volume_name):
-        self._refresh_volume_repl(source_pool,volume_name) if self._check_local_volumes(volume_name) else self._init_volume_repl(source_pool,volume_name)
+    def _get_source_volumes(self, remote):
+        return self.source_volumes[remote].by_pool("user.repl-volume")
+
+    def _print_source_volumes_pretty(self,remote,pool,volumes):
+        table_data =  [["Source", "Pool", "Project", "Name", "Content-Type", "Snapshots"]]
+        table_data += [[remote, pool, volume['project'], volume['name'], volume['content_type'], volume['snaps']] for volume in volumes]
+        print_table(table_data)
+
+    def _check_local_volumes(self, remote, volume):
+        return self.target_volumes.exists(self.target_pool, self._replica_name(remote, volume.project, volume.name))
+
+    def _copy_volume(self, remote, volume, refresh=False):
+        return self._try(self.client.copy_volume, remote, volume.pool, volume.name, self.target_pool, self._replica_name(remote, volume.project, volume.name),
+            source_project=volume.project, refresh=refresh)
+
+    def _volume_key(self, remote, volume):
+        return self._state_key(remote, "volume", volume.pool, volume.project, volume.name)
+
+    def _init_volume_repl(self, remote, volume):
+        logging.info(f"Initial replication for storage volume { self._display(remote, volume.pool) }/custom/{ volume.name }")
+        self.journal.update(self._volume_key(remote, volume), step="init")
+        error = self._copy_volume(remote, volume)
+
+        if error:
+            raise RuntimeError(f"ERROR[INIT]: { volume.pool }/{ volume.name }: {error}")
+
+    def _refresh_volume_repl(self, remote, volume):
+        logging.info(f"Update replication for storage volume { self._display(remote, volume.pool) }/custom/{ volume.name }")
+        self.journal.update(self._volume_key(remote, volume), step="refresh")
+        error = self._copy_volume(remote, volume, refresh=True)
+
+        if error:
+            raise RuntimeError(f"ERROR[INIT]: { volume.pool }/{ volume.name }: {error}")
+
+    def repl_volume(self, remote, volume):
+        self._refresh_volume_repl(remote, volume) if self._check_local_volumes(remote, volume) else self._init_volume_repl(remote, volume)
+        self.journal.update(self._volume_key(remote, volume), step="replicated")
+        self.target_volumes.add(self.target_pool, self._replica_name(remote, volume.project, volume.name))
+
+    def keep_instance_clones(self, instance):
+        logging.info(f"Create clone for { self._label(instance) }")
+        all_snaps,last_snap_name = self._get_clone_instance_snap(instance)
+        if last_snap_name:
+            self._clone_instance_snap(instance,last_snap_name)
+        all_clones = self._get_clone_instances(instance)
+        if len(all_clones) > self.keep_count:
+            logging.info(f"Cleanup clones for { self._label(instance) }")
+            clones_to_delete = all_clones[:-self.keep_count]
+            self._purge_instance_clones(clones_to_delete)
+
+    # Planner
+    def _state_key(self, remote, kind, *names):
+        return "/".join([remote, kind, *names])
+
+    def _plan_changes(self, state, snapshots):
+        if not state:
+            return "no successful sync recorded"
+        if self.max_sync_age and expiry_to_date(self.max_sync_age, datetime.datetime.fromisoformat(state['last_success'])) < datetime.datetime.now(datetime.timezone.utc):
+            return f"last sync { state['last_success'] } older than { self.max_sync_age }"
+        new, gone = set(snapshots) - set(state['snapshots']), set(state['snapshots']) - set(snapshots)
+        if new or gone:
+            return f"snapshots changed (+{ len(new) }/-{ len(gone) })"
+
+    def _unchanged(self, state):
+        # only --incremental skips, otherwise unchanged items are refreshed all the same
+        if self.incremental:
+            return "skip", f"unchanged since { state['last_success'] }"
+        return "refresh", f"unchanged since { state['last_success'] }, refreshed without --incremental"
+
+    def _plan_instance(self, instance):
+        if not self._check_local_repl(instance):
+            return "init", "no replica on target"
+        state = self.sync_state.get(self._state_key(instance['remote'], "instance", instance['project'], instance['name']))
+        reason = self._plan_changes(state, [s['name'] for s in instance['snapshots'] or []])
+        if not reason and instance.get('status') != "Stopped":
+            reason = "instance running, data may have changed"
+        if not reason and instance.get('last_used_at') != state.get('last_used_at'):
+            reason = "instance used since last sync"
+        return ("refresh", reason) if reason else self._unchanged(state)
+
+    def _plan_volume(self, remote, volume):
+        if not self._check_local_volumes(remote, volume):
+            return "init", "no replica on target"
+        state = self.sync_state.get(self._state_key(remote, "volume", volume.pool, volume.project, volume.name))
+        reason = self._plan_changes(state, volume.snapshots)
+        if not reason and self._attached_running(remote, volume):
+            reason = "attached to a running instance, data may have changed"
+        return ("refresh", reason) if reason else self._unchanged(state)
+
+    def _attached_running(self, remote, volume):
+        # instances not tagged for replication are not listed, their state is unknown and counts as running
+        for user in volume.used_by:
+            url = urllib.parse.urlsplit(user)
+            path = url.path.split("/")
+            if len(path) > 3 and path[2] == "instances":
+                project = urllib.parse.parse_qs(url.query).get('project', [volume.project])[0]
+                if self._statuses.get((remote, project, urllib.parse.unquote(path[3])), "Running") != "Stopped":
+                    return True
+        return False
+
+    def plan(self):
+        self._statuses = {(i['remote'], i['project'], i['name']): i.get('status') for i in self.instances}
+        items = []
+        for instance in self.instances:
+            action, reason = self._plan_instance(instance)
+            items.append(dict(kind="instance", remote=instance['remote'], name=self._display(instance['remote'], instance['name']), item=instance, action=action, reason=reason))
+        for remote, catalog in self.source_volumes.items():
+            for volume in catalog.filtered("user.repl-volume"):
+                action, reason = self._plan_volume(remote, volume)
+                items.append(dict(kind="volume", remote=remote, name=self._display(remote, f"{ volume.pool }/{ volume.name }"), item=volume, action=action, reason=reason))
+        self._check_names(items)
+        return items
+
+    def _check_names(self, items):
+        # replicas must get valid instance names and two items must never share one replica
+        replicas = {}
+        for item in items:
+            if item['kind'] == "instance":
+                name    = self._replica_name(item['remote'], item['item']['project'], item['item']['name'])
+                # keep--<key>-<19 chars of snapshot name>
+                clone   = 26 + len(self._key(item['remote'], item['item']['project'], item['item']['name'])) if self.keep else 0
+                replica = name
+            else:
+                name    = self._replica_name(item['remote'], item['item'].project, item['item'].name)
+                clone   = 0
+                replica = f"{ self.target_pool }/{ name }"
+            if max(len(name), clone) > MAX_NAME:
+                item['action'], item['reason'] = "reject", f"replica or clone name of { max(len(name), clone) } chars would be longer than { MAX_NAME }"
+                continue
+            other = replicas.setdefault((item['kind'], replica), item)
+            if other is not item:
+                item['action'], item['reason'] = "reject", f"replica { replica } already used by { other['name'] }"
+
+    def _print_plan(self, items):
+        table_data =  [["Kind", "Name", "Action", "Reason", "Predicted", "Last sync"]]
+        table_data += [[i['kind'], i['name'], i['action'], i['reason'], self._format_duration(i.get('predicted')), i.get('last_success') or "never"] for i in items]
+        print_table(table_data)
+
+    # Scheduler
+    def _item_key(self, item):
+        if item['kind'] == "instance":
+            return self._instance_key(item['item'])
+        return self._volume_key(item['remote'], item['item'])
+
+    def _instance_size(self, instance):
+        # root disk usage where the listing reports it
+        return (((instance.get('state') or {}).get('disk') or {}).get('root') or {}).get('usage')
+
+    def _item_size(self, item):
+        # custom volumes carry no usage
+        if item['kind'] == "instance":
+            return self._instance_size(item['item'])
+
+    def _transfer(self, item):
+        # skipped items are predicted as the refresh they would need
+        return "refresh" if item['action'] == "skip" else item['action']
+
+    def _format_duration(self, seconds):
+        return "unknown" if seconds is None else f"{ seconds:.0f}s"
+
+    def _predict(self, items):
+        # own history first, then size / measured init throughput, then the median of the same kind and action
+        history, sizes, seconds = {}, 0, 0
+        for item in items:
+            state = self.sync_state.get(self._item_key(item)) or {}
+            item['last_success'] = state.get('last_success')
+            item['predicted'] = state.get(f"duration_{ self._transfer(item) }")
+            if item['predicted'] is not None:
+                history.setdefault((item['kind'], self._transfer(item)), []).append(item['predicted'])
+            if state.get('size') and state.get('duration_init'):
+                sizes, seconds = sizes + state['size'], seconds + state['duration_init']
+        for item in items:
+            size = self._item_size(item)
+            if item['predicted'] is None and item['action'] == "init" and size and sizes:
+                item['predicted'] = size * seconds / sizes
+            if item['predicted'] is None and (item['kind'], self._transfer(item)) in history:
+                item['predicted'] = statistics.median(history[(item['kind'], self._transfer(item))])
+
+    def _defer(self, item, reason):
+        logging.warning(f"Defer { item['kind'] } { item['name'] }: { reason }")
+        self.deferred.append(dict(kind=item['kind'], name=item['name'], predicted=item.get('predicted'), reason=reason))
+
+    def schedule(self, plan):
+        # Admission by oldest successful sync (never synced first) against the worker time left
+        # until the deadline, then longest predicted transfers first to keep the makespan short.
+        # every item is predicted, --plan shows the last sync and prediction of skipped ones as well
+        self._predict(plan)
+        work = [item for item in plan if item['action'] in ("init", "refresh")]
+        if self.deadline:
+            window   = (self.deadline - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            capacity = {None: self.jobs * window, "instance": self.instance_jobs * window, "volume": self.volume_jobs * window}
+            capacity.update({remote: self.source_jobs * window for remote in self.sources})
+            for item in sorted(work, key=lambda i: i['last_success'] or ""):
+                predicted = item['predicted'] or 0
+                if predicted > window or any(predicted > capacity[c] for c in (None, item['kind'], item['remote'])):
+                    item['action'], item['reason'] = "defer", f"predicted { predicted:.0f}s does not fit before { self.deadline.astimezone():%H:%M }"
+                    continue
+                for c in (None, item['kind'], item['remote']):
+                    capacity[c] -= predicted
+        work.sort(key=lambda i: (-(i['predicted'] or 0), i['last_success'] or ""))
+        scheduled = {id(item) for item in work}
+        return work + [item for item in plan if id(item) not in scheduled]
+
+    def _print_deferred(self):
+        table_data =  [["Kind", "Name", "Predicted", "Reason"]]
+        table_data += [[d['kind'], d['name'], self._format_duration(d['predicted']), d['reason']] for d in self.deferred]
+        print_table(table_data)
+
+    # Journal
+    def _cleanup(self, item):
+        # undo what an interrupted or failed attempt left behind, so the item can start over
+        key     = self._item_key(item)
+        entry   = self.journal.items.get(key, {})
+        if item['kind'] == "volume":
+            volume  = item['item']
+            name    = self._replica_name(item['remote'], volume.project, volume.name)
+            if entry.get('step') == "init" and self.client.volume_exists(None, self.target_pool, name):
+                logging.warning(f"Delete half-created replica { self.target_pool }/{ name }")
+                self._try(self.client.delete_volume, None, self.target_pool, name)
+                self.target_volumes.remove(self.target_pool, name)
+        else:
+            instance    = item['item']
+            name        = self._replica_name(instance['remote'], instance['project'], instance['name'])
+            if entry.get('presync_snapshot'):
+                for remote, snap_of, project in ((instance['remote'], instance['name'], instance['project']), (None, name, self.target_project)):
+                    self._try(self.client.delete_instance_snapshot, remote, snap_of, entry['presync_snapshot'], project)
+            # only an initial copy is half-created, a pre-seeded replica is kept for the delta
+            for created in ([name] if entry.get('step') == "init" else []) + ([entry['clone']] if entry.get('clone') else []):
+                if self.client.instance_exists(None, created, self.target_project):
+                    logging.warning(f"Delete half-created { created }")
+                    self._try(self.client.delete_instance, None, created, self.target_project)
+                    self.inventory.remove(created)
+            if entry.get('stopped'):
+                logging.warning(f"Starting { self._label(instance) }, stopped by an interrupted replication")
+                error = self._try(self.client.start_instance, instance['remote'], instance['name'], instance['project'])
+                if error:
+                    logging.error(f"Could not start { self._label(instance) }: { error }")
+                else:
+                    instance['status'] = "Running" # listed while stopped, is stopped again for the next attempt
+                    self.journal.update(key, stopped=False)
+        self.journal.update(key, step="presync-delta" if entry.get('step') == "presync-delta" else None, presync_snapshot=None, clone=None)
+
+    async def _resume(self):
+        outstanding, interrupted = self.journal.outstanding(), self.journal.interrupted()
+        logging.info(f"Resume run started { self.journal.run.get('started') }: { len(outstanding) } of { len(self.journal.items) } items outstanding")
+        self.journal.resume()
+        work = [item for item in self.plan() if self._item_key(item) in outstanding]
+        await asyncio.gather(*[asyncio.to_thread(self._try, self._cleanup, item) for item in work if self._item_key(item) in interrupted])
+        # planned again, cleanup may have removed replicas
+        keys = {self._item_key(item) for item in work}
+        return [item for item in self.plan() if self._item_key(item) in keys]
+
+    def _try(self, func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+        except IncusError as e:
+            return str(e)
+
+    # Output
+    def _print_summary(self):
+        table_data =  [["Kind", "Name", "Result", "Duration", "Error"]]
+        table_data += [[r['kind'], r['name'], "ok" if r['ok'] else "failed", f"{ r['duration']:.1f}s", r['error'].strip().splitlines()[-1] if r['error'].strip() else ""] for r in self.results]
+        print_table(table_data)
+
+    # Metrics
+    def report(self):
+        if self.profile:
+            table_data =  [["Operation", "Item", "Duration", "Return code"]]
+            table_data += [[o['operation'], o['item'], f"{ o['duration']:.2f}s", o['returncode']] for o in self.metrics.slowest(self.profile)]
+            print_table(table_data)
+        self.metrics.export(self.metrics_file, self.report_file)
+
+    # Workers
+    async def _run_job(self, jobs, kind_jobs, kind, name, func, item):
+        key, attempt = self._item_key(item), 0
+        while True:
+            # per source first, so waiting for a busy source never holds a target-side slot
+            async with self.source_slots[item['remote']], kind_jobs, jobs:
+                # predictions may have been too optimistic for the items before
+                if self.deadline and datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=item.get('predicted') or 0) > self.deadline:
+                    self._defer(item, f"predicted { item.get('predicted') or 0:.0f}s would end after the deadline")
+                    self.journal.update(key, status="planned")
+                    return
+                attempt += 1
+                self.journal.begin(key)
+                start = time.monotonic()
+                try:
+                    await asyncio.to_thread(func, item)
+                    result = dict(kind=kind, name=name, ok=True, error="")
+                except Exception as e:
+                    logging.error(f"Replication of { kind } { name } failed: { e }")
+                    result = dict(kind=kind, name=name, ok=False, error=str(e))
+                    await asyncio.to_thread(self._try, self._cleanup, item)
+                result['duration'] = time.monotonic() - start
+            delay = backoff_delay(self.retry_backoff, attempt)
+            if result['ok'] or attempt > self.retries or not is_transient(result['error']) or \
+                    (self.deadline and datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=delay) > self.deadline):
+                break
+            # waiting without a slot, other items go on meanwhile
+            logging.warning(f"Retry { kind } { name } in { delay:g}s ({ attempt } of { self.retries } retries)")
+            await asyncio.sleep(delay)
+        self.journal.update(key, status="done" if result['ok'] else "failed", error=result['error'] or None)
+        self.results.append(result)
+        self.metrics.item(kind, name, result['duration'], result['ok'])
+
+    def _record_success(self, item, start, **values):
+        # smoothed duration per action for the scheduler of later runs
+        key         = self._item_key(item)
+        duration    = time.monotonic() - start
+        previous    = (self.sync_state.get(key) or {}).get(f"duration_{ self._transfer(item) }")
+        if previous is not None:
+            duration = (previous + duration) / 2
+        size = self._item_size(item)
+        self.sync_state.update(key, **values, **({"size": size} if size else {}), **{f"duration_{ self._transfer(item) }": round(duration, 3)}, last_success=self._now())
+
+    def _repl_instance_job(self, item):
+        start, instance = time.monotonic(), item['item']
+        self.repl_instance(instance) # handle replication
+        if self.keep: # handle clones
+            self.keep_instance_clones(instance)
+        self._record_success(item, start, snapshots=[s['name'] for s in self._replica(instance)['snapshots']],
+            last_used_at=instance.get('last_used_at'))
+
+    def _repl_volume_job(self, item):
+        start, volume = time.monotonic(), item['item']
+        self.repl_volume(item['remote'], volume)
+        self._record_success(item, start, snapshots=list(volume.snapshots))
 
     # replication
-    def invoke(self):
+    async def invoke(self):
         if self.verbose:
             logging.getLogger().setLevel(logging.DEBUG)
             logging.debug("Debug: Running in Debug mode")
 
         if self.list_only: # handle list
+            await self.discover(target=False)
             if self.instances:
                 self._print_source_instances()
-            for pool in self.source_pools:
-                volumes = self._get_source_volumes(pool)
-                if volumes:
-                    self._print_source_volumes_pretty(pool,volumes)
+            for remote in self.source_volumes:
+                for pool, volumes in self._get_source_volumes(remote).items():
+                    self._print_source_volumes_pretty(remote,pool,volumes)
+            sys.exit(1 if self.results else 0)
+
+        await self.discover()
+
+        self.source_slots = {remote: asyncio.Semaphore(self.source_jobs) for remote in self.sources}
+        jobs            = asyncio.Semaphore(self.jobs)
+        instance_jobs   = asyncio.Semaphore(self.instance_jobs)
+        volume_jobs     = asyncio.Semaphore(self.volume_jobs)
+
+        if self.plan_only:
+            self._print_plan(self.schedule(self.plan()))
             sys.exit(0)
 
-        for instance in self.instances:
-            self.repl_instance(instance) # handle replication
-            if self.keep: # handle clones
-                logging.info(f"Create clone for { instance['name'] }")
-                all_snaps,last_snap_name = self._get_clone_instance_snap(instance['name'])
-                if last_snap_name:
-                    self._clone_instance_snap(instance['name'],last_snap_name)
-                all_clones = self._get_clone_instances(instance['name'])
-                if len(all_clones) > self.keep_count:
-                    logging.info(f"Cleanup clones for { instance['name'] }")
-                    clones_to_delete = all_clones[:-self.keep_count]
-                    self._purge_instance_clones(clones_to_delete)
-
-        if self.source_pools: # handle storage
-            for pool in self.source_pools:
-                volumes = self._get_source_volumes(pool)
-                [self.repl_volume(pool,volume['name']) for volume in volumes]
+        resume = self.resume and self.journal.resumable
+        if self.resume and not resume:
+            if self.journal.given_up():
+                logging.warning(f"Give up { len(self.journal.given_up()) } items still outstanding after { MAX_RESUMES } resumed runs")
+            logging.info(f"No run with outstanding items in { self.journal.path }, start a new run")
+        plan = self.schedule(await self._resume() if resume else self.plan())
+
+        for item in plan:
+            if item['action'] == "skip":
+                logging.info(f"Skip { item['kind'] } { item['name'] }: { item['reason'] }")
+        plan = [item for item in plan if item['action'] != "skip"]
+        for item in plan:
+            if item['action'] == "defer":
+                self._defer(item, item['reason'])
+            elif item['action'] == "reject":
+                # not journaled, a resumed run would reject it all the same
+                logging.error(f"Reject { item['kind'] } { item['name'] }: { item['reason'] }")
+                self.results.append(dict(kind=item['kind'], name=item['name'], ok=False, error=f"ERROR[NAME]: { item['reason'] }", duration=0))
+        plan = [item for item in plan if item['action'] != "reject"]
+        if not resume:
+            self.journal.start(tool="repl", sources=self.sources)
+        self.journal.plan([self._item_key(item) for item in plan])
+        plan = [item for item in plan if item['action'] != "defer"]
+        clear_errors = await self.clear_snaps_bulk([item['item'] for item in plan if item['kind'] == "instance"]) if self.clear_snaps else {}
+
+        tasks = []
+        for item in plan:
+            if item['kind'] == "instance" and (item['remote'], item['item']['project'], item['item']['name']) in clear_errors:
+                self.results.append(dict(kind="instance", name=item['name'], ok=False, error=clear_errors[(item['remote'], item['item']['project'], item['item']['name'])], duration=0))
+                self.journal.update(self._item_key(item), status="failed", error=self.results[-1]['error'])
+            elif item['kind'] == "instance":
+                tasks.append(self._run_job(jobs, instance_jobs, "instance", item['name'], self._repl_instance_job, item))
+            else: # handle storage
+                tasks.append(self._run_job(jobs, volume_jobs, "volume", item['name'], self._repl_volume_job, item))
+        await asyncio.gather(*tasks)
+        self.journal.finish()
+
+        if self.results:
+            self._print_summary()
+        if self.deferred:
+            logging.warning(f"{ len(self.deferred) } replications deferred to the next run")
+            self._print_deferred()
+        failed = [r for r in self.results if not r['ok']]
+        if failed:
+            logging.error(f"{ len(failed) } of { len(self.results) } replications failed")
+            sys.exit(1)
 
 if __name__ == "__main__":
     _parser = argparse.ArgumentParser(description="Python script for automate replications")
     # list group
-    _parser.add_argument('--source-server', type=str, required=True,
+    _parser.add_argument('--source-server', type=str,
                 help="Remote source server")
+    _parser.add_argument('--sources', type=str,
+                help="Comma separated remote source servers replicated in one run, replicas are named <prefix>--<source>--<name>")
+    _parser.add_argument('--sources-file', type=str, help="File with one remote source server per line, same as --sources")
     _parser.add_argument('--repl-prefix', type=str, required=False,
                 help="Prefix instance name with entered value")
     _parser.add_argument('--target-project', type=str, default='default',
@@ -255,17 +835,77 @@ if __name__ == "__main__":
     _parser.add_argument('--snap-name-to-clear', type=str, default="None",
                 help="All snapshots containing this string, will be deleted on source before replication")
     _parser.add_argument('--list-sources', action="store_true", help="List replication enables resources on source server and exit")
+    _parser.add_argument('--presync', action="store_true",
+                help="Initial replication of running containers from a temporary snapshot, stopping them only for the final delta")
     _parser.add_argument('--keep', type=str, help="Clone after run and keep x numbers of clones")
     _parser.add_argument('--keep-count', type=int, default=0, help="Clone after run and keep x numbers of clones")
+    _parser.add_argument('--client', choices=["cli", "api"], default="cli",
+                help="Talk to incus through the incus command (cli) or directly through the REST API (api)")
+    _parser.add_argument('--jobs', type=int, default=1, help="Number of replications running in parallel in total, i.e. against the local target")
+    _parser.add_argument('--source-jobs', type=int, help="Limit parallel replications per source server (default: --jobs)")
+    _parser.add_argument('--instance-jobs', type=int, help="Limit parallel instance replications (default: --jobs)")
+    _parser.add_argument('--volume-jobs', type=int, help="Limit parallel custom volume replications (default: --jobs)")
+    _parser.add_argument('--state-file', type=str, default="/var/lib/incus-tools/repl-state.json",
+                help="File to record the last successful sync of every instance and volume")
+    _parser.add_argument('--incremental', action="store_true", help="Skip instances and volumes without changes since their last successful sync")
+    _parser.add_argument('--max-sync-age', type=str,
+                help="With --incremental, refresh unchanged items anyway after this time (same syntax as incus --expiry, e.g. 7d)")
+    _parser.add_argument('--plan', action="store_true", help="Print what would be transferred and why, then exit")
+    _parser.add_argument('--deadline', type=str,
+                help="End of the replication window (HH:MM or a duration like 4H), transfers predicted to end later are deferred")
+    _parser.add_argument('--journal-file', type=str, default="/var/lib/incus-tools/repl-journal.jsonl",
+                help="File recording the progress of every item of the current run, for --resume")
+    _parser.add_argument('--resume', action="store_true",
+                help="Continue the outstanding items of an interrupted run from --journal-file, start a new run if there is none")
+    _parser.add_argument('--retries', type=int, default=2, help="Retry transient failures of an item this many times")
+    _parser.add_argument('--retry-backoff', type=float, default=30, help="Seconds before the first retry, doubled for every further one")
+    _parser.add_argument('--metrics-file', type=str,
+                help="Write timings of all incus calls as prometheus node-exporter textfile (e.g. /var/lib/prometheus/node-exporter/incus_repl_instance.prom)")
+    _parser.add_argument('--report-file', type=str, help="Write a JSON report with the timings of all items and incus calls")
+    _parser.add_argument('--profile', type=int, metavar="N", help="Print the N slowest incus calls at the end")
     _parser.add_argument('--verbose',action="store_true", help="Verbose output")
     args    =   _parser.parse_args()
 
-    if args.list_sources and (not args.source_server):
-        _parser.error("When --list-sources, --source-server is required.")
+    if bool(args.source_server) == bool(args.sources or args.sources_file):
+        _parser.error("Either --source-server or --sources/--sources-file is required.")
+    args.sources = [args.source_server] if args.source_server else [s.strip() for s in (args.sources or "").split(",") if s.strip()]
+    if args.sources_file:
+        try:
+            with open(args.sources_file) as f:
+                args.sources += [line.split("#")[0].strip() for line in f if line.split("#")[0].strip()]
+        except OSError as e:
+            _parser.error(f"Could not read --sources-file: { e }")
+    args.sources = list(dict.fromkeys(args.sources))
+    if not args.sources:
+        _parser.error("No source servers given.")
+    if not args.source_server:
+        # the source is part of the replica names
+        names = {}
+        for source in args.sources:
+            names.setdefault(IncusReplicator.name_part(source), []).append(source)
+        if "" in names or any(len(sources) > 1 for sources in names.values()):
+            _parser.error(f"Source names must give distinct replica names: { ', '.join('/'.join(s) for n, s in names.items() if not n or len(s) > 1) }")
 
     if args.keep and (not args.keep_count):
         _parser.error("When --keep, --keep-count is required.")
 
     #print(args.__dict__)
+    if min(args.jobs, args.instance_jobs or 1, args.volume_jobs or 1, args.source_jobs or 1) < 1:
+        _parser.error("--jobs, --instance-jobs, --volume-jobs and --source-jobs must be at least 1.")
+
+    if args.retries < 0 or args.retry_backoff < 0:
+        _parser.error("--retries and --retry-backoff must not be negative.")
+
+    if args.deadline:
+        try:
+            args.deadline = parse_deadline(args.deadline)
+        except ValueError as e:
+            _parser.error(str(e))
+
     replicator = IncusReplicator(**args.__dict__)
-    replicator.invoke()
\ No newline at end of file
+    try:
+        asyncio.run(replicator.invoke())
+    finally:
+        if not (args.list_sources or args.plan):
+            replicator.sync_state.flush()
+            replicator.report()
\ No newline at end of file
@@ -3,6 +3,13 @@ wget -O /usr/local/bin/incus-repl-instance https://raw.githubusercontent.com/Chr
 chown root:root /usr/local/bin/incus-repl-instance
 chmod 0700 /usr/local/bin/incus-repl-instance
 
+
+# shared modules
+mkdir -p /usr/local/lib/incus-tools
+for module in incus_client incus_catalog incus_retention incus_metrics incus_journal incus_output; do
+    wget -O /usr/local/lib/incus-tools/$module.py https://raw.githubusercontent.com/ChrisStro/incus-tools/refs/heads/main/common/$module.py
+done
+
 # config file
 cat << EOF > /etc/incus-repl-instance.conf
 source_server               =   MYREMOTESERVER
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+import importlib.util
+import unittest.mock
+import threading
+import tempfile
+import unittest
+import asyncio
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+sys.path[0:0] = [os.path.join(ROOT, d) for d in ("common", "benchmark")]
+from incus_client import IncusAPI, IncusCLI, IncusError
+from fake_incus import FakeIncus
+
+spec = importlib.util.spec_from_file_location("incus_auto_snapshot", os.path.join(ROOT, "auto-snapshot", "incus-auto-snapshot.py"))
+auto_snapshot = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(auto_snapshot)
+
+class SnapDaemonTest(unittest.TestCase):
+    # The daemon inventory kept current from the event stream of the REST stand-in
+    def setUp(self):
+        self.tmp    = tempfile.TemporaryDirectory()
+        self.fake   = FakeIncus(FakeIncus.generate("local", 4, 2, snapshots=0, projects=2))
+        socket_path = os.path.join(self.tmp.name, "unix.socket")
+        self.server = self.fake.serve_api(socket_path)
+        self.api    = IncusAPI(socket_path, remotes={}, fallback=IncusCLI())
+        self.journal_file = os.path.join(self.tmp.name, "journal.jsonl")
+        with unittest.mock.patch.dict(os.environ, INCUS_SOCKET=socket_path):
+            self.snapper = auto_snapshot.IncusSnapper(client="api", project="default", daemon=True, include_volumes=False, list_enabled=False,
+                prefix=None, expiry=None, retention=None, jobs=4, pool_jobs={}, journal_file=self.journal_file, resume=False, retries=0,
+                retry_backoff=0, metrics_file=None, report_file=None, profile=None, verbose=False)
+        self.daemon = auto_snapshot.IncusSnapDaemon(self.snapper, [])
+        self.daemon.refresh_instances()
+
+        self.watcher = threading.Thread(target=self._watch, daemon=True)
+        self.watcher.start()
+        while not self.fake._subscribers:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.fake.emit(None)
+        self.watcher.join(5)
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def _watch(self):
+        # _watch_events without the reconnect
+        try:
+            for event in self.daemon.events():
+                self.daemon.apply_event(event)
+        except IncusError:
+            pass
+
+    def _wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "event not applied")
+            time.sleep(0.01)
+
+    def _add_instance(self, project, name):
+        instance = dict(self.fake.servers['local']['instances'][("default", "instance0")], name=name, project=project, snapshots=[])
+        self.fake.servers['local']['instances'][(project, name)] = instance
+        self.fake.lifecycle("instance-created", f"/1.0/instances/{ name }", project)
+
+    def test_inventory_follows_events(self):
+        self.assertEqual(sorted(self.daemon.inventory), [("default", "instance0"), ("default", "instance2")])
+
+        self._add_instance("project1", "other")
+        self._add_instance("default", "web")
+        self._wait_for(lambda: ("default", "web") in self.daemon.inventory)
+        self.api.delete_instance(None, "instance2")
+        self._wait_for(lambda: ("default", "instance2") not in self.daemon.inventory)
+        self.api.create_instance_snapshot(None, "instance0", "manual")
+        self._wait_for(lambda: "manual" in [s['name'] for s in self.daemon.inventory[("default", "instance0")]['snapshots']])
+
+        self.assertEqual(sorted(self.daemon.inventory), [("default", "instance0"), ("default", "web")])
+
+    def test_other_projects_ignored(self):
+        # instance1 of project1 is enabled as well, the event of an unfiltered stream must not add it
+        self.daemon.apply_event({"type": "lifecycle", "project": "project1", "metadata": {"action": "instance-updated", "source": "/1.0/instances/instance1?project=project1"}})
+        self.assertEqual(sorted(self.daemon.inventory), [("default", "instance0"), ("default", "instance2")])
+
+    def test_current_project(self):
+        # without --project the stream is scoped to the current project, so every event is applied
+        self.snapper.project = None
+        instance = dict(self.fake.servers['local']['instances'][("default", "instance0")], name="web", snapshots=[])
+        self.fake.servers['local']['instances'][("default", "web")] = instance
+        self.daemon.apply_event({"type": "lifecycle", "project": "default", "metadata": {"action": "instance-created", "source": "/1.0/instances/web"}})
+        self.assertEqual(sorted(self.daemon.inventory), [("default", "instance0"), ("default", "instance2"), ("default", "web")])
+
+    def test_fire(self):
+        self._add_instance("default", "web")
+        self._wait_for(lambda: ("default", "web") in self.daemon.inventory)
+        schedule = dict(prefix="frequent", cron=auto_snapshot.CronSchedule("*/20 * * * *"), expiry="2H", include_volumes=True, retention=None)
+        asyncio.run(self.daemon.fire(schedule))
+
+        instances = self.fake.servers['local']['instances']
+        volumes = self.fake.servers['local']['volumes']
+        for snapshots in [instances[("default", n)]['snapshots'] for n in ("instance0", "instance2", "web")] + [v['snapshots'] for v in volumes.values()]:
+            self.assertEqual([s['name'] for s in snapshots], [self.snapper.snapshot_name])
+        self.assertEqual(instances[("project1", "instance1")]['snapshots'], [])
+
+        with open(self.journal_file) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(entries[0]['prefix'], "frequent")
+        self.assertIn('finished', entries[-1])
+        journal = auto_snapshot.RunJournal(self.journal_file)
+        self.assertEqual(len(journal.items), 5)
+        self.assertFalse(journal.outstanding())
+
+    def test_fire_failed(self):
+        # a schedule that raises is logged, its journal finished and its metrics exported
+        self.snapper.metrics_file = os.path.join(self.tmp.name, "metrics.prom")
+        schedule = dict(prefix="frequent", cron=auto_snapshot.CronSchedule("*/20 * * * *"), expiry=None, include_volumes=True, retention=None)
+        with unittest.mock.patch.object(self.snapper, "_get_snap_items", side_effect=IncusError("Error: Failed to list storage pools", 1)):
+            with self.assertLogs(level="ERROR") as logs:
+                asyncio.run(self.daemon.fire(schedule))
+        self.assertIn("Schedule frequent failed: Error: Failed to list storage pools", logs.output[-1])
+        with open(self.journal_file) as f:
+            self.assertIn('finished', json.loads(f.readlines()[-1]))
+        self.assertTrue(os.path.exists(self.snapper.metrics_file))
+
+        # the next schedule runs as usual
+        asyncio.run(self.daemon.fire(schedule))
+        self.assertEqual(len(auto_snapshot.RunJournal(self.journal_file).items), 4)
+
+if __name__ == "__main__":
+    unittest.main()
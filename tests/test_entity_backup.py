@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+import importlib.util
+import tempfile
+import unittest
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+sys.path[0:0] = [os.path.join(ROOT, "common")]
+
+spec = importlib.util.spec_from_file_location("incus_entity_backup", os.path.join(ROOT, "entity-backup", "incus-entity-backup.py"))
+entity_backup = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(entity_backup)
+
+class DedupStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp    = tempfile.TemporaryDirectory()
+        self.store  = entity_backup.DedupStore(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _backup(self, name, document):
+        writer = entity_backup.DedupWriter(self.store, name)
+        writer.add(f"{ name }/default/profile-default.yaml", document)
+        return writer.close()
+
+    def test_same_second(self):
+        # a second backup within the same second must not replace the first one
+        name = "incus-backup-2026-10-18_12-00-00"
+        self._backup(name, b"first")
+        with self.assertLogs(level="WARNING"):
+            self._backup(name, b"second")
+        self._backup("incus-backup-2026-10-18_12-00-01", b"third")
+
+        self.assertEqual(self.store.backups(), [name, f"{ name }-1", "incus-backup-2026-10-18_12-00-01"])
+        self.assertEqual(self.store.load(f"{ name }-1")['name'], f"{ name }-1")
+        documents = [self.store.read(self.store.load(b)['entities']["default/profile-default.yaml"]) for b in self.store.backups()]
+        self.assertEqual(documents, [b"first", b"second", b"third"])
+        self.assertEqual(sorted(os.listdir(self.store.manifests)), sorted(f"{ b }.json" for b in self.store.backups()))
+
+    def test_prune(self):
+        for second, document in enumerate((b"a", b"b", b"b")):
+            self._backup(f"incus-backup-2026-10-18_12-00-0{ second }", document)
+        self.store.prune(2, float("inf"))
+        self.assertEqual(self.store.backups(), ["incus-backup-2026-10-18_12-00-01", "incus-backup-2026-10-18_12-00-02"])
+        self.assertEqual(self.store.resolve("latest"), "incus-backup-2026-10-18_12-00-02")
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(self.store.objects)), 1)
+
+if __name__ == "__main__":
+    unittest.main()
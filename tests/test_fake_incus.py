@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+
+import unittest
+import json
+import sys
+import os
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "benchmark")]
+from fake_incus import FakeIncus
+
+class FakeIncusTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeIncus(FakeIncus.generate("src", 1, 0, snapshots=1))
+        self.snapshot = self.fake.servers['src']['instances'][("default", "instance0")]['snapshots'][0]['name']
+
+    def test_split(self):
+        self.assertEqual(self.fake._split("src:instance0"), ("src", "instance0"))
+        self.assertEqual(self.fake._split("src:"), ("src", ""))
+        self.assertEqual(self.fake._split("instance0"), ("local", "instance0"))
+        # only a ':' before the first '/' separates the remote
+        self.assertEqual(self.fake._split(f"instance0/{ self.snapshot }"), ("local", f"instance0/{ self.snapshot }"))
+        self.assertEqual(self.fake._split(f"src:instance0/{ self.snapshot }"), ("src", f"instance0/{ self.snapshot }"))
+
+    def test_copy_from_snapshot(self):
+        self.assertIn(":", self.snapshot)
+        self.assertEqual(self.fake.handle(["copy", "src:instance0", "repl--instance0"])[0], 0)
+        rc, _, stderr = self.fake.handle(["copy", f"repl--instance0/{ self.snapshot }", "keep--instance0"])
+        self.assertEqual((rc, stderr), (0, ""))
+        rc, stdout, _ = self.fake.handle(["list", "-f", "json"])
+        self.assertEqual(sorted(i['name'] for i in json.loads(stdout)), ["keep--instance0", "repl--instance0"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+import threading
+import tempfile
+import unittest
+import time
+import sys
+import os
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", d) for d in ("common", "benchmark")]
+from incus_client import IncusAPI, IncusCLI, IncusError
+from fake_incus import FakeIncus
+
+class IncusAPITest(unittest.TestCase):
+    # IncusAPI against the REST stand-in of the fake incus server
+    def setUp(self):
+        self.tmp    = tempfile.TemporaryDirectory()
+        self.fake   = FakeIncus(FakeIncus.generate("local", 4, 2, snapshots=2, projects=2))
+        socket_path = os.path.join(self.tmp.name, "unix.socket")
+        self.server = self.fake.serve_api(socket_path)
+        self.api    = IncusAPI(socket_path, remotes={}, fallback=IncusCLI())
+
+    def tearDown(self):
+        self.fake.emit(None)
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_list_instances(self):
+        self.assertEqual(sorted(i['name'] for i in self.api.list_instances()), ["instance0", "instance2"])
+        self.assertEqual(sorted(i['name'] for i in self.api.list_instances(project="project1")), ["instance1", "instance3"])
+        self.assertEqual(len(self.api.list_instances(all_projects=True)), 4)
+        self.assertEqual(len(self.api.list_instances(filters={"user.repl-instance": "true"})), 2)
+        self.assertEqual(self.api.list_instances(filters={"user.repl-instance": "false"}), [])
+
+    def test_list_volumes(self):
+        volumes = [v for v in self.api.list_all_volumes() if "/" not in v['name']]
+        self.assertEqual(sorted(v['name'] for v in volumes), ["volume0", "volume1"])
+        self.assertEqual([v['name'] for v in self.api.list_volumes(None, "fast") if "/" not in v['name']], ["volume0"])
+        self.assertEqual(self.api.list_pools(), ["default", "fast"])
+
+    def test_not_found(self):
+        self.assertIsNone(self.api.get_instance(None, "missing"))
+        self.assertFalse(self.api.instance_exists(None, "instance1"))
+        self.assertTrue(self.api.instance_exists(None, "instance1", "project1"))
+        self.assertFalse(self.api.volume_exists(None, "default", "volume0"))
+        with self.assertRaises(IncusError) as error:
+            self.api.request(None, "GET", "/1.0/instances/missing")
+        self.assertEqual(error.exception.returncode, 404)
+
+    def test_operation_wait(self):
+        self.fake.latency = {"snapshot create": 0.2}
+        self.api.create_instance_snapshot(None, "instance0", "snap0")
+        # returns only once the operation finished
+        self.assertIn("snap0", [s['name'] for s in self.api.list_instance_snapshots(None, "instance0")])
+        self.api.delete_instance_snapshot(None, "instance0", "snap0")
+        self.assertNotIn("snap0", [s['name'] for s in self.api.list_instance_snapshots(None, "instance0")])
+
+        self.api.stop_instance(None, "instance0")
+        self.assertEqual(self.api.get_instance(None, "instance0")['status'], "Stopped")
+        self.api.copy_instance(None, "instance0", "copy0", target_project="project1", config={"boot.autostart": "false"})
+        self.assertEqual(self.api.get_instance(None, "copy0", "project1")['config']['boot.autostart'], "false")
+        self.api.delete_instance(None, "copy0", "project1")
+        self.assertFalse(self.api.instance_exists(None, "copy0", "project1"))
+
+    def test_operation_failure(self):
+        with self.assertRaises(IncusError) as error:
+            self.api.create_instance_snapshot(None, "instance0", self.fake.servers['local']['instances'][("default", "instance0")]['snapshots'][0]['name'])
+        self.assertIn("already exists", str(error.exception))
+        self.fake.failures = {"storage volume snapshot create": 1}
+        with self.assertRaises(IncusError):
+            self.api.create_volume_snapshot(None, "fast", "volume0", "snap0")
+
+    def test_reconnect(self):
+        self.fake.drop_idle = True
+        with self.assertLogs(level="DEBUG") as logs:
+            for _ in range(3):
+                self.assertEqual(len(self.api.list_instances()), 2)
+        # every request after the first one found its keep-alive connection closed
+        self.assertEqual(sum("Reconnect to local" in line for line in logs.output), 2)
+
+    def test_events(self):
+        events = []
+
+        def watch():
+            stream = self.api.events()
+            try:
+                for event in stream:
+                    events.append(event)
+            except IncusError:
+                pass # closed with the stream
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+        while not self.fake._subscribers:
+            time.sleep(0.01)
+        self.api.create_instance_snapshot(None, "instance1", "snap0", "project1")
+        self.fake.emit({"type": "logging", "metadata": {"message": "filtered"}})
+        self.fake.lifecycle("instance-updated", "/1.0/instances/" + "x" * 200)
+        self.fake.emit(None)
+        watcher.join(5)
+
+        self.assertFalse(watcher.is_alive())
+        self.assertEqual([e['metadata']['action'] for e in events], ["instance-snapshot-created", "instance-updated"])
+        self.assertEqual(events[0]['metadata']['source'], "/1.0/instances/instance1/snapshots/snap0?project=project1")
+        self.assertEqual(len(events[1]['metadata']['source']), 215)
+
+if __name__ == "__main__":
+    unittest.main()
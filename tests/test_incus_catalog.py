@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+
+import unittest
+import sys
+import os
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "common")]
+from incus_catalog import VolumeCatalog
+
+class VolumeCatalogTest(unittest.TestCase):
+    def test_group_shared_prefix(self):
+        # snapshots of "mydata" and "data2" must not be counted for "data"
+        entries = [dict(pool="default", name=name, config={"user.repl-volume": "true"}) for name in
+            ("data", "data/snap0", "mydata", "mydata/snap0", "mydata/snap1", "data2", "data2/snap0", "data2/snap1", "data2/snap2")]
+        entries.append(dict(pool="fast", project="project1", name="data/snap9"))
+        volumes = VolumeCatalog(None)._group(entries)
+
+        self.assertEqual(sorted(volumes), [("default", "default", "data"), ("default", "default", "data2"), ("default", "default", "mydata")])
+        self.assertEqual(volumes[("default", "default", "data")].snapshots, ["snap0"])
+        self.assertEqual(volumes[("default", "default", "mydata")].snapshots, ["snap0", "snap1"])
+        self.assertEqual(volumes[("default", "default", "data2")].snapshots, ["snap0", "snap1", "snap2"])
+
+    def test_by_pool(self):
+        catalog = VolumeCatalog(None)
+        catalog._volumes = catalog._group([dict(pool="default", name=name, config={"user.repl-volume": "true"}) for name in ("data", "data/snap0", "data2", "data2/snap0", "data2/snap1")])
+        self.assertEqual({v['name']: v['snaps'] for v in catalog.by_pool("user.repl-volume")["default"]}, {"data": 1, "data2": 2})
+        self.assertTrue(catalog.exists("default", "data"))
+        self.assertFalse(catalog.exists("default", "dat"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+import tempfile
+import unittest
+import json
+import sys
+import os
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "common")]
+from incus_journal import RunJournal, MAX_RESUMES, backoff_delay, is_transient
+
+class RunJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp    = tempfile.TemporaryDirectory()
+        self.path   = os.path.join(self.tmp.name, "journal.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _partial_run(self):
+        # killed while working on b, c was not started
+        journal = RunJournal(self.path)
+        journal.start(tool="test", jobs=2)
+        journal.plan(["a", "b", "c"])
+        journal.begin("a")
+        journal.update("a", status="done")
+        journal.begin("b", step="init")
+        journal.close()
+
+    def test_resume(self):
+        self._partial_run()
+        journal = RunJournal(self.path)
+        self.assertTrue(journal.resumable)
+        self.assertEqual(journal.run['tool'], "test")
+        self.assertEqual(journal.outstanding(), {"b", "c"})
+        self.assertEqual(list(journal.interrupted()), ["b"])
+        self.assertEqual(journal.items["b"]['step'], "init")
+
+        journal.resume()
+        # planning the same items again keeps their state and attempts
+        journal.plan(["a", "b", "c"])
+        self.assertEqual(journal.begin("b"), 2)
+        journal.update("b", status="done")
+        journal.close()
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1 + 3 + 1 + 2) # compacted header and items, resumed, b
+        journal = RunJournal(self.path)
+        self.assertEqual(journal.run['resumes'], 1)
+        self.assertEqual(journal.outstanding(), {"c"})
+        self.assertEqual(journal.items["a"]['attempts'], 1)
+
+        # finished or not, a run with outstanding items is given up after MAX_RESUMES
+        for _ in range(MAX_RESUMES - 1):
+            journal.resume()
+            journal.finish()
+            journal = RunJournal(self.path)
+        self.assertFalse(journal.resumable)
+        self.assertEqual(journal.given_up(), {"c"})
+
+        journal.start(tool="test")
+        self.assertFalse(journal.resumable)
+        self.assertEqual(RunJournal(self.path).items, {})
+
+    def test_truncated_last_line(self):
+        self._partial_run()
+        with open(self.path, "a") as f:
+            f.write(json.dumps(dict(key="b", status="done"))[:20])
+        with self.assertLogs(level="WARNING"):
+            journal = RunJournal(self.path)
+        self.assertEqual(journal.status("b"), "in-progress")
+        self.assertEqual(journal.outstanding(), {"b", "c"})
+
+        # the torn line is dropped, not continued
+        journal.resume()
+        journal.update("c", status="done")
+        journal.close()
+        with open(self.path) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(entries[-1]['key'], "c")
+        self.assertEqual(RunJournal(self.path).outstanding(), {"b"})
+
+    def test_backoff(self):
+        self.assertEqual([backoff_delay(5, attempt) for attempt in range(1, 5)], [5, 10, 20, 40])
+        self.assertEqual(backoff_delay(0, 3), 0)
+        self.assertTrue(is_transient("Error: websocket: close 1006 (abnormal closure)"))
+        self.assertFalse(is_transient("Error: Instance not found"))
+        self.assertFalse(is_transient("Error: Storage volume already exists"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+
+import unittest
+import sys
+import os
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "common")]
+from incus_client import IncusError
+from incus_metrics import MetricsRecorder, InstrumentedClient
+
+class Client():
+    def copy_instance(self, source_remote, source, target, **kwargs):
+        if target == "broken":
+            raise IncusError("Simulated failure", 1)
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics    = MetricsRecorder("repl")
+        self.client     = InstrumentedClient(Client(), self.metrics)
+
+    def test_failures_counter(self):
+        self.client.copy_instance("src", "instance0", "repl--instance0")
+        with self.assertRaises(IncusError):
+            self.client.copy_instance("src", "instance1", "broken")
+        lines = self.metrics.prometheus().splitlines()
+        self.assertIn("# TYPE incus_tools_operation_failures_total counter", lines)
+        self.assertIn('incus_tools_operation_failures_total{tool="repl",operation="init"} 1', lines)
+
+    def test_transfer_size(self):
+        with self.client.transfer_size(1 << 30):
+            self.client.copy_instance("src", "instance0", "repl--instance0")
+        self.client.copy_instance("src", "instance1", "repl--instance1", refresh=True)
+        self.assertEqual([o['bytes'] for o in self.metrics.operations], [1 << 30, None])
+        lines = self.metrics.prometheus().splitlines()
+        self.assertIn('incus_tools_transferred_bytes{tool="repl",operation="init",item="instance0"} 1073741824', lines)
+        self.assertFalse([line for line in lines if "transferred_bytes{" in line and "instance1" in line])
+
+if __name__ == "__main__":
+    unittest.main()
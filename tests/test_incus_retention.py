@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+import datetime
+import unittest
+import random
+import sys
+import os
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "common")]
+from incus_retention import RetentionPolicy, plan_deletions, snapshot_time
+
+def snap(prefix, time):
+    return f"incus-auto-snap-{ prefix }-{ time.strftime('%H:%M:%S_%d-%m-%Y') }"
+
+class RetentionPolicyTest(unittest.TestCase):
+    def test_buckets(self):
+        # 2026-03-10 is a tuesday, 03-08 and 03-01 are sundays of the two weeks before
+        times = {letter: datetime.datetime(2026, month, day, hour) for letter, (month, day, hour) in zip("abcdefghi",
+            [(3, 10, 18), (3, 10, 12), (3, 10, 6), (3, 9, 18), (3, 9, 6), (3, 8, 12), (3, 1, 12), (2, 15, 12), (1, 20, 12)])}
+        snapshots = list(times.items())
+        random.Random(0).shuffle(snapshots)
+        policy = RetentionPolicy.parse("last=2,daily=3,weekly=2,monthly=3")
+
+        keep, delete = policy.split(snapshots)
+        # last: a b, daily: a d f, weekly: a f, monthly: a h i
+        self.assertEqual(keep, list("abdfhi"))
+        self.assertEqual(delete, list("ceg"))
+
+        # only the newest snapshot of a day counts for the day
+        keep, delete = RetentionPolicy(daily=2).split(snapshots)
+        self.assertEqual((keep, delete), (list("ad"), list("bcefghi")))
+        self.assertEqual(RetentionPolicy(last=20).split(snapshots), (list("abcdefghi"), []))
+
+    def test_empty_policy(self):
+        for spec in ("", "last=0", "daily=0,weekly=0"):
+            with self.assertRaises(ValueError):
+                RetentionPolicy.parse(spec)
+        with self.assertRaises(ValueError):
+            RetentionPolicy.parse("daily=-1")
+        with self.assertRaises(ValueError):
+            RetentionPolicy.parse("days=7")
+        self.assertEqual(str(RetentionPolicy.parse("last=2, daily=0, weekly=4")), "last=2,weekly=4")
+
+    def test_foreign_snapshots_kept(self):
+        times = [datetime.datetime(2026, 1, day, 12) for day in (1, 2, 3)]
+        foreign = ["manual", "incus-auto-snap-daily", "incus-auto-snap-daily-25:00:00_01-01-2026", "incus-auto-snap-daily-12:00:00_2026-01-01",
+            snap("hourly", datetime.datetime(2025, 1, 1)), snap("daily", times[0]) + "-copy"]
+        target = dict(remote=None, pool="default", project="default", name="volume0", snapshots=foreign + [snap("daily", t) for t in times])
+
+        self.assertIsNone(snapshot_time(foreign[2]))
+        self.assertIsNone(snapshot_time(foreign[4], "daily"))
+        deletions = plan_deletions(RetentionPolicy(last=1), [target], prefix="daily")
+        self.assertEqual([d['snapshot'] for d in deletions], [snap("daily", times[1]), snap("daily", times[0])])
+        self.assertEqual({(d['pool'], d['name']) for d in deletions}, {("default", "volume0")})
+
+        # without a prefix, snapshots of every schedule are pruned, but still only parsable ones
+        deletions = plan_deletions(RetentionPolicy(last=1), [target])
+        self.assertEqual([d['snapshot'] for d in deletions], [snap("daily", times[1]), snap("daily", times[0]), foreign[4]])
+        self.assertEqual(plan_deletions(RetentionPolicy(last=1), [dict(target, snapshots=foreign[:4])]), [])
+
+if __name__ == "__main__":
+    unittest.main()
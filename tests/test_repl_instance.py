@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+import importlib.util
+import unittest.mock
+import subprocess
+import tempfile
+import unittest
+import datetime
+import asyncio
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+sys.path[0:0] = [os.path.join(ROOT, d) for d in ("common", "benchmark")]
+from incus_client import IncusCLI
+from fake_incus import FakeIncus
+
+SCRIPT = os.path.join(ROOT, "repl-instance", "incus-repl-instance.py")
+spec = importlib.util.spec_from_file_location("incus_repl_instance", SCRIPT)
+repl_instance = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(repl_instance)
+
+# command line defaults of incus-repl-instance
+DEFAULTS = dict(source_server="src", sources=["src"], sources_file=None, repl_prefix="repl", target_project="default", target_custom_volume_pool="default",
+    snap_name_to_clear="None", list_sources=False, presync=False, keep=None, keep_count=0, client="cli", jobs=1, source_jobs=None, instance_jobs=None,
+    volume_jobs=None, incremental=False, max_sync_age=None, plan=False, deadline=None, resume=False, retries=0, retry_backoff=0,
+    metrics_file=None, report_file=None, profile=None, verbose=False)
+
+class ReplTestCase(unittest.TestCase):
+    # incus-repl-instance against the fake incus command
+    def setUp(self):
+        self.tmp    = tempfile.TemporaryDirectory()
+        self.fake   = FakeIncus(FakeIncus.generate("src", 4, 2))
+        socket_path = os.path.join(self.tmp.name, "incus.socket")
+        self.server = self.fake.serve(socket_path)
+        self.env    = dict(os.environ, FAKE_INCUS_SOCKET=socket_path, PATH=f"{ os.path.join(ROOT, 'benchmark') }:{ os.environ['PATH'] }")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def run_tool(self, *args, prefix="repl"):
+        files = ["--state-file", os.path.join(self.tmp.name, "state.json"), "--journal-file", os.path.join(self.tmp.name, "journal.jsonl")]
+        files += ["--repl-prefix", prefix] if prefix else []
+        return subprocess.run([sys.executable, SCRIPT, "--source-server", "src", "--target-custom-volume-pool", "default", *files, *args],
+            env=self.env, capture_output=True, text=True)
+
+    def replicator(self, **kwargs):
+        with unittest.mock.patch.dict(os.environ, self.env):
+            replicator = repl_instance.IncusReplicator(**dict(DEFAULTS, state_file=os.path.join(self.tmp.name, "state.json"),
+                journal_file=os.path.join(self.tmp.name, "journal.jsonl"), **kwargs))
+            asyncio.run(replicator.discover())
+        return replicator
+
+    def plan(self, replicator):
+        with unittest.mock.patch.dict(os.environ, self.env):
+            return {item['name']: item for item in replicator.plan()}
+
+class NamesTest(ReplTestCase):
+    def test_without_prefix(self):
+        result = self.run_tool(prefix=None)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn(("default", "None--instance0"), self.fake.servers['local']['instances'])
+        self.assertIn(("default", "default", "None--volume0"), self.fake.servers['local']['volumes'])
+
+    def test_long_names_rejected(self):
+        servers = self.fake.servers['src']
+        servers['instances'][("default", "i" * 60)] = dict(servers['instances'][("default", "instance0")], name="i" * 60)
+        servers['volumes'][("fast", "default", "v" * 60)] = dict(servers['volumes'][("fast", "default", "volume0")], name="v" * 60)
+        plan = self.plan(self.replicator())
+        self.assertEqual(plan["i" * 60]['action'], "reject")
+        self.assertEqual(plan["fast/" + "v" * 60]['action'], "reject")
+        self.assertEqual(plan["instance0"]['action'], "init")
+
+        # the clone name is 26 chars longer than the instance name
+        plan = self.plan(self.replicator(repl_prefix=None, keep="daily", keep_count=2))
+        self.assertEqual(plan["instance0"]['action'], "init")
+        servers['instances'][("default", "i" * 40)] = dict(servers['instances'][("default", "instance0")], name="i" * 40)
+        plan = self.plan(self.replicator(repl_prefix=None, keep="daily", keep_count=2))
+        self.assertEqual(plan["i" * 40]['action'], "reject")
+
+class InventoryTest(ReplTestCase):
+    def test_clones_of(self):
+        instances = self.fake.servers['local']['instances']
+        template = self.fake.servers['src']['instances'][("default", "instance0")]
+        for name, created_at in (("repl--web", "2026-01-01"), ("repl--web2", "2026-01-01"), ("keep--repl--web-2026-01-02-00-00-00", "2026-01-02"),
+                ("keep--repl--web2-2026-01-02-00-00-00", "2026-01-02"), ("keep--repl--web-2026-01-01-00-00-00", "2026-01-01"), ("keep--web", "2026-01-01")):
+            instances[("default", name)] = dict(template, name=name, created_at=created_at, snapshots=[])
+        with unittest.mock.patch.dict(os.environ, self.env):
+            inventory = repl_instance.TargetInventory(IncusCLI(), "default")
+
+        # the clones of repl--web2 start with the name of the clones of repl--web
+        self.assertEqual(inventory.clones_of("repl--web"), ["keep--repl--web-2026-01-01-00-00-00", "keep--repl--web-2026-01-02-00-00-00"])
+        self.assertEqual(inventory.clones_of("repl--web2"), ["keep--repl--web2-2026-01-02-00-00-00"])
+        inventory.remove("keep--repl--web-2026-01-01-00-00-00")
+        self.assertEqual(inventory.clones_of("repl--web"), ["keep--repl--web-2026-01-02-00-00-00"])
+
+class PlanTest(ReplTestCase):
+    def setUp(self):
+        super().setUp()
+        for instance in self.fake.servers['src']['instances'].values():
+            instance['status'] = "Stopped"
+        result = self.run_tool()
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_unchanged(self):
+        plan = self.plan(self.replicator(incremental=True))
+        self.assertEqual({item['action'] for item in plan.values()}, {"skip"})
+
+        # without --incremental the plan shows the refresh the run does
+        plan = self.plan(self.replicator())
+        self.assertEqual({item['action'] for item in plan.values()}, {"refresh"})
+        self.assertTrue(all(item['reason'].endswith("refreshed without --incremental") for item in plan.values()))
+        result = self.run_tool()
+        self.assertEqual(result.stderr.count("Update replication"), len(plan))
+
+    def test_changes(self):
+        instances = self.fake.servers['src']['instances']
+        instances[("default", "instance1")]['status'] = "Running"
+        instances[("default", "instance2")]['snapshots'].append({"name": "new", "created_at": "2026-02-01T00:00:00+00:00"})
+        self.fake.servers['src']['volumes'][("fast", "default", "volume0")]['used_by'] = ["/1.0/instances/instance1"]
+        del self.fake.servers['local']['instances'][("default", "repl--instance3")]
+        plan = self.plan(self.replicator(incremental=True))
+        self.assertEqual({name: (item['action'], item['reason']) for name, item in plan.items() if item['action'] != "skip"}, {
+            "instance1": ("refresh", "instance running, data may have changed"),
+            "instance2": ("refresh", "snapshots changed (+1/-0)"),
+            "instance3": ("init", "no replica on target"),
+            "fast/volume0": ("refresh", "attached to a running instance, data may have changed"),
+        })
+
+    def _history(self, replicator, plan, **durations):
+        # refresh duration and last sync per item, a missing duration has no history
+        for days, (name, duration) in enumerate(durations.items()):
+            state = replicator.sync_state.items[replicator._item_key(plan[name])]
+            state['last_success'] = f"2026-01-0{ days + 1 }T00:00:00+00:00"
+            state.pop('duration_refresh', None)
+            if duration is not None:
+                state['duration_refresh'] = duration
+
+    def test_schedule(self):
+        replicator = self.replicator()
+        plan = self.plan(replicator)
+        self._history(replicator, plan, **{"instance1": 50, "instance2": 30, "fast/volume0": 25, "instance0": 10, "instance3": None, "default/volume1": 5})
+
+        # longest predicted first, without history the median of the same kind and action
+        order = [(item['name'], item['predicted']) for item in replicator.schedule(list(plan.values()))]
+        self.assertEqual(order, [("instance1", 50), ("instance2", 30), ("instance3", 30), ("fast/volume0", 25), ("instance0", 10), ("default/volume1", 5)])
+
+        # admitted by oldest sync while the time left until the deadline lasts
+        replicator.deadline = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=100)
+        scheduled = {item['name']: item['action'] for item in replicator.schedule(list(plan.values()))}
+        self.assertEqual(scheduled, {"instance1": "refresh", "instance2": "refresh", "fast/volume0": "defer", "instance0": "refresh", "instance3": "defer", "default/volume1": "refresh"})
+
+    def test_predict_all(self):
+        # skipped and rejected items get a prediction and their last sync as well
+        self.fake.servers['src']['instances'][("default", "instance0")]['status'] = "Running"
+        replicator = self.replicator(incremental=True)
+        plan = self.plan(replicator)
+        plan["instance1"]['action'] = "reject"
+        self._history(replicator, plan, **{"instance2": 30, "fast/volume0": 20})
+        scheduled = replicator.schedule(list(plan.values()))
+        self.assertEqual(len(scheduled), len(plan))
+        self.assertEqual(scheduled[0]['name'], "instance0")
+        self.assertEqual({item['action'] for item in scheduled}, {"refresh", "skip", "reject"})
+        self.assertTrue(all(item['last_success'] for item in scheduled))
+        self.assertEqual({item['name']: item['predicted'] for item in scheduled},
+            {"instance0": 30, "instance1": None, "instance2": 30, "instance3": 30, "fast/volume0": 20, "default/volume1": 20})
+
+class RetryTest(ReplTestCase):
+    def test_retry_and_resume(self):
+        self.fake.failures = {"copy": 1, "storage volume copy": 1}
+        result = self.run_tool("--retries", "2", "--retry-backoff", "0.01", "--jobs", "4")
+        self.assertNotEqual(result.returncode, 0)
+        # 1st retry after the backoff, then doubled
+        self.assertEqual(result.stderr.count("in 0.01s (1 of 2 retries)"), 6)
+        self.assertEqual(result.stderr.count("in 0.02s (2 of 2 retries)"), 6)
+        journal = repl_instance.RunJournal(os.path.join(self.tmp.name, "journal.jsonl"))
+        self.assertEqual({(item['status'], item['attempts']) for item in journal.items.values()}, {("failed", 3)})
+
+        self.fake.failures = {}
+        result = self.run_tool("--resume")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        journal.load()
+        self.assertEqual(journal.run['resumes'], 1)
+        self.assertEqual({(item['status'], item['attempts']) for item in journal.items.values()}, {("done", 4)})
+
+if __name__ == "__main__":
+    unittest.main()